@@ -0,0 +1,68 @@
+import json
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as c
+from thor_mlops.clean import ThorTableCleaner
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.metrics import ThorMetrics
+
+# Latency of ThorTableCleaner.transform / ThorStarSchema.enrich vs their compiled plans on small batches (synthetic data)
+# A compiled one row enrich is still hundreds of microseconds: the per call joins, calculation and missing fills below dominate it
+N_SKUS, N_STORES, REPEATS = 50_000, 100, 200
+rng = np.random.default_rng(42)
+
+t_sk = pa.table({
+    'sku_key': pa.array(np.arange(N_SKUS)),
+    'original_price': pa.array(rng.uniform(1, 100, N_SKUS)),
+    'group_key': pa.array(rng.choice([f'g{i}' for i in range(50)], N_SKUS)),
+    'sku_name': pa.array([f'sku {i}' for i in range(N_SKUS)]),
+    'properties': pa.array([json.dumps({'brand': f'b{i % 30}', 'season': ['SS', 'AW'][i % 2], 'colors': i % 5}) for i in range(N_SKUS)]),
+})
+t_st = pa.table({'store_key': pa.array(np.arange(N_STORES)), 'store_size': pa.array(rng.uniform(50, 500, N_STORES))})
+t_sc = pa.table({
+    'sku_key': pa.array(rng.integers(0, N_SKUS, 10_000)),
+    'store_key': pa.array(rng.integers(0, N_STORES, 10_000)),
+    'stock': pa.array(rng.integers(0, 10, 10_000)),
+})
+
+sts = ThorStarSchema(
+    numericals=['original_price', 'store_size', 'stock', 'properties/colors', 'discount_value'],
+    categoricals=['group_key', 'sku_name', 'properties/brand'],
+    one_hots=['properties/season'],
+    label='stock',
+)
+sts.register_table(name='skus', table=t_sk, keys=['sku_key'], json_columns=['properties'])
+sts.register_table(name='stores', table=t_st, keys=['store_key'])
+sts.register_calculation(name='discount_value', func=lambda t: c.multiply(t.column('original_price_c'), 0.1))
+sts.enrich(base=t_sc) # MEASURE UNFITTED COLUMNS
+plan = sts.compile()
+
+cln = ThorTableCleaner()
+cln.register(numericals=['original_price'], categoricals=['group_key', 'sku_name'])
+cln.transform(t_sk)
+cln_plan = cln.compile()
+
+def latency(func, base):
+    func(base) # WARMUP
+    timings = []
+    for _ in range(REPEATS):
+        t = time.perf_counter()
+        func(base)
+        timings.append(time.perf_counter() - t)
+    return np.percentile(timings, 50) * 1e6, np.percentile(timings, 99) * 1e6
+
+print("batch  method              p50 (us)   p99 (us)")
+for size in [1, 10, 1000]:
+    base, raw = t_sc.slice(length=size), t_sk.slice(length=size)
+    for name, func, table in [('transform', cln.transform, raw), ('transform compiled', cln_plan.transform, raw), ('enrich', sts.enrich, base), ('enrich compiled', plan.enrich, base)]:
+        p50, p99 = latency(func, table)
+        print(f"{size:<6} {name:<19} {p50:>9.0f} {p99:>10.0f}")
+
+# WHERE A COMPILED ONE ROW ENRICH SPENDS ITS TIME
+metrics = ThorMetrics()
+for _ in range(REPEATS):
+    plan.enrich(t_sc.slice(length=1), metrics=metrics)
+print("\nstage        name              us per call")
+for r in metrics.summary().to_pylist():
+    print(f"{r['stage']:<12} {str(r['name'] or ''):<17} {r['seconds_sum'] / r['seconds_count'] * 1e6:>11.0f}")
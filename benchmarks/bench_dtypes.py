@@ -0,0 +1,33 @@
+import time
+from thor_mlops.clean import ThorTableCleaner, DtypePolicy
+import synthetic
+
+# Memory footprint and transform time of the cleaned features per dtype policy
+ROWS = 1_000_000
+table = synthetic.tall_table(rows=ROWS, numericals=6, categoricals=4)
+table = table.append_column('one_hot', table.column('cat_0'))
+
+POLICIES = {
+    'default': DtypePolicy(),
+    'smallest integers': DtypePolicy(integers='smallest'),
+    'no rounding': DtypePolicy(rounding=False),
+    'float16': DtypePolicy(floats='float16', rounding=False),
+    'uint8 quantized': DtypePolicy(floats='uint8', rounding=False),
+    'dictionary one-hot': DtypePolicy(one_hot='dictionary'),
+    'compact': DtypePolicy.compact(),
+}
+
+print(f"{ROWS:,} rows, 6 numericals, 4 categoricals, 1 one-hot with 10 categories")
+print(f"{'policy':<20} {'MB':>8} {'bytes/row':>10} {'transform (ms)':>15}")
+for name, policy in POLICIES.items():
+    cln = ThorTableCleaner(policy=policy)
+    cln.register(numericals=[col for col in table.column_names if col.startswith('num_')], categoricals=[col for col in table.column_names if col.startswith('cat_')], one_hots=['one_hot'])
+    cln.transform(table)
+    timings = []
+    for _ in range(3):
+        t = time.perf_counter()
+        X, _ = cln.transform(table)
+        timings.append(time.perf_counter() - t)
+    report = cln.footprint(X)
+    total = sum(report.column('bytes').to_pylist())
+    print(f"{name:<20} {total / 2 ** 20:>8.1f} {total / ROWS:>10.1f} {min(timings) * 1e3:>15.1f}")
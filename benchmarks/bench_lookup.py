@@ -0,0 +1,38 @@
+import time
+import numpy as np
+import pyarrow as pa
+from thor_mlops.starschema import ThorStarSchema
+
+# Indexed dimension lookups vs hash joins in ThorStarSchema.enrich (synthetic data)
+N_SKUS, N_STORES, REPEATS = 1_000_000, 500, 20
+rng = np.random.default_rng(42)
+
+t_sk = pa.table({
+    'sku_key': pa.array(rng.permutation(N_SKUS)),
+    'original_price': pa.array(rng.uniform(1, 100, N_SKUS)),
+    'group_key': pa.array(rng.choice([f'g{i}' for i in range(50)], N_SKUS)),
+})
+t_ss = pa.table({ # COMPOSITE KEY
+    'sku_key': pa.array(np.repeat(np.arange(N_SKUS // 100), N_STORES // 5)),
+    'store_key': pa.array(np.tile(np.arange(N_STORES // 5), N_SKUS // 100)),
+    'sales': pa.array(rng.uniform(0, 10, N_SKUS // 100 * N_STORES // 5)),
+})
+
+sts = ThorStarSchema(numericals=['original_price', 'sales'], categoricals=['group_key'], one_hots=[], label=None)
+t = time.perf_counter()
+sts.register_table(name='skus', table=t_sk, keys=['sku_key'])
+sts.register_table(name='sku_stores', table=t_ss, keys=['sku_key', 'store_key'])
+print(f"Registering (cleaning + indexing) took {time.perf_counter() - t:.2f}s")
+
+def timing(base, indexed):
+    sts.enrich(base=base, indexed=indexed) # WARMUP
+    t = time.perf_counter()
+    for _ in range(REPEATS):
+        sts.enrich(base=base, indexed=indexed)
+    return (time.perf_counter() - t) / REPEATS * 1e3
+
+print("base rows   join (ms)   index (ms)   speedup")
+for size in [1, 100, 10_000, 1_000_000]:
+    base = pa.table({'sku_key': pa.array(rng.integers(0, N_SKUS, size)), 'store_key': pa.array(rng.integers(0, N_STORES, size))})
+    joined, indexed = timing(base, False), timing(base, True)
+    print(f"{size:<11} {joined:>9.2f} {indexed:>12.2f} {joined / indexed:>9.1f}x")
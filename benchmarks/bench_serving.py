@@ -0,0 +1,73 @@
+import time
+import asyncio
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as c
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.serve import ThorBatcher
+import synthetic
+
+# Load test: concurrent single row enrich requests, micro-batched (ThorBatcher) vs one enrich per request
+#   python benchmarks/bench_serving.py --clients 64 --seconds 5
+
+def fitted_star_schema() -> ThorStarSchema:
+    tables = synthetic.star_schema_tables(skus=50_000, base_rows=10_000)
+    sts = ThorStarSchema(
+        numericals=[f'sku_num_{i}' for i in range(4)] + ['sales', 'properties/key_0', 'properties/key_1', 'margin'],
+        categoricals=['sku_name', 'properties/brand'] + [f'store_cat_{i}' for i in range(3)],
+        one_hots=['properties/season'],
+        label='stock',
+    )
+    sts.register_table(name='skus', table=tables['skus'], keys=['sku_key'], json_columns=['properties'])
+    sts.register_table(name='stores', table=tables['stores'], keys=['store_key'])
+    sts.register_table(name='sku_stores', table=tables['sku_stores'], keys=['sku_key', 'store_key'])
+    sts.register_calculation(name='margin', func=lambda t: c.subtract(t.column('sku_num_0_c'), t.column('sku_num_1_c')))
+    sts.enrich(tables['base'])
+    return sts, tables['base'].to_pylist()
+
+async def client(call, rows: list, stop: float, latencies: list, seed: int):
+    # CLOSED LOOP: NEXT REQUEST AS SOON AS THE PREVIOUS ONE RETURNS
+    rng = np.random.default_rng(seed)
+    loop = asyncio.get_running_loop()
+    while loop.time() < stop:
+        row = rows[rng.integers(len(rows))]
+        t = time.perf_counter()
+        await call(row)
+        latencies.append(time.perf_counter() - t)
+
+async def load(call, rows: list, clients: int, seconds: float) -> dict:
+    latencies, start = [], time.perf_counter()
+    stop = asyncio.get_running_loop().time() + seconds
+    await asyncio.gather(*[client(call, rows, stop, latencies, seed=i) for i in range(clients)])
+    elapsed, ms = time.perf_counter() - start, np.array(latencies) * 1e3
+    return {'requests': len(ms), 'throughput': len(ms) / elapsed, 'p50': np.percentile(ms, 50), 'p95': np.percentile(ms, 95), 'p99': np.percentile(ms, 99), 'max': ms.max()}
+
+async def main(args):
+    sts, rows = fitted_star_schema()
+    schema = pa.schema([('sku_key', pa.int64()), ('store_key', pa.int64()), ('stock', pa.int64())])
+    plan = sts.compile()
+    results = {}
+
+    # BASELINE: EVERY REQUEST ENRICHES ITS OWN ONE ROW BASE TABLE IN A THREAD (LIKE A PLAIN ASYNC WEB HANDLER)
+    async def unbatched(row):
+        return await asyncio.to_thread(plan.enrich, pa.Table.from_pylist([row], schema=schema))
+    results['unbatched'] = await load(unbatched, rows, clients=args.clients, seconds=args.seconds)
+
+    for latency in args.latencies:
+        async with ThorBatcher(sts, max_batch=args.max_batch, max_latency=latency / 1e3, schema=schema) as batcher:
+            results[f'batched {latency:g} ms'] = await load(batcher.enrich, rows, clients=args.clients, seconds=args.seconds)
+            results[f'batched {latency:g} ms']['batch'] = batcher.requests / max(batcher.batches, 1)
+
+    print(f"{args.clients} concurrent clients, {args.seconds:g} s per scenario")
+    print(f"{'scenario':<18} {'requests/s':>11} {'mean batch':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<18} {r['throughput']:>11,.0f} {r.get('batch', 1):>11.1f} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['p99']:>8.2f} {r['max']:>8.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test of micro-batched vs unbatched enrich")
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--latencies', type=float, nargs='*', default=[0.5, 2.0], help="latency windows in ms")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import json
+import tempfile
+import subprocess
+import numpy as np
+import pyarrow as pa
+from thor_mlops.clean import ThorTableCleaner
+
+# Cold start (load + first transform of one row) of a cleaner with large vocabularies: JSON vs binary (memory mapped) format
+VOCAB, CATEGORICALS, NUMERICALS = 500_000, 4, 50
+rng = np.random.default_rng(0)
+
+vocab = pa.array([f'category {i}' for i in range(VOCAB)])
+table = pa.table({
+    **{f'num_{i}': pa.array(rng.normal(size=VOCAB)) for i in range(NUMERICALS)},
+    **{f'cat_{i}': vocab.take(pa.array(rng.permutation(VOCAB))) for i in range(CATEGORICALS)},
+})
+cln = ThorTableCleaner()
+cln.register(numericals=[f'num_{i}' for i in range(NUMERICALS)], categoricals=[f'cat_{i}' for i in range(CATEGORICALS)])
+cln.transform(table)
+
+path = tempfile.mkdtemp()
+cln.to_json(os.path.join(path, 'cleaner.json'))
+cln.save(os.path.join(path, 'binary'))
+with pa.OSFile(os.path.join(path, 'row.arrow'), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+    writer.write_table(table.slice(length=1))
+
+# EVERY SCENARIO RUNS IN A FRESH INTERPRETER, SO NOTHING IS CACHED IN THE PROCESS
+CHILD = """
+import sys, time, json, pyarrow as pa
+from thor_mlops.clean import ThorTableCleaner
+path, mode = sys.argv[1], sys.argv[2]
+row = pa.ipc.open_file(pa.memory_map(path + '/row.arrow')).read_all()
+t = time.perf_counter()
+cln = (ThorTableCleaner.from_json(path + '/cleaner.json') if mode.startswith('json') else ThorTableCleaner.load(path + '/binary'))
+loaded = time.perf_counter() - t
+run = (cln.compile().transform if mode.endswith('compiled') else cln.transform)
+run(row)
+first = time.perf_counter() - t
+run(row)
+print(json.dumps({'load': loaded, 'first': first, 'second': time.perf_counter() - t - first}))
+"""
+
+size = lambda p: sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(p) for f in files) if os.path.isdir(p) else os.path.getsize(p)
+print(f"{CATEGORICALS} categoricals with {VOCAB:,} categories, json {size(os.path.join(path, 'cleaner.json')) / 2 ** 20:.1f} MB, binary {size(os.path.join(path, 'binary')) / 2 ** 20:.1f} MB")
+print("format   transform   load (ms)   load + first row (ms)   next row (ms)")
+for mode in ['json', 'json compiled', 'binary', 'binary compiled']:
+    out = subprocess.run([sys.executable, '-c', CHILD, path, mode], capture_output=True, text=True, env=os.environ, check=True)
+    r = json.loads(out.stdout)
+    fmt, transform = (mode.split(' ') + ['plain'])[:2]
+    print(f"{fmt:<8} {transform:<11} {r['load'] * 1e3:>9.1f} {r['first'] * 1e3:>23.1f} {r['second'] * 1e3:>15.2f}")
+
+# STEADY STATE LATENCY OF ONE ROW PER VOCABULARY SIZE (LOOKUPS MUST NOT SCAN THE VOCABULARY PER CALL)
+print("\ncategories   transform   p50 (ms)   p99 (ms)")
+for n in [5_000, 50_000, 500_000]:
+    small = ThorTableCleaner()
+    small.register_categorical('cat_0', categories=vocab.slice(length=n).to_pylist())
+    row = table.select(['cat_0']).slice(length=1)
+    for transform, run in [('plain', small.transform), ('compiled', small.compile().transform)]:
+        run(row) # WARMUP (BUILDS THE SORTED ORDER)
+        timings = []
+        for _ in range(200):
+            t = time.perf_counter()
+            run(row)
+            timings.append(time.perf_counter() - t)
+        print(f"{n:<12,} {transform:<11} {np.percentile(timings, 50) * 1e3:>8.2f} {np.percentile(timings, 99) * 1e3:>10.2f}")
@@ -0,0 +1,47 @@
+import time
+import numpy as np
+import pyarrow as pa
+from thor_mlops.ops import replace_columns
+from thor_mlops.starschema import ThorStarSchema
+
+# Wide schemas: one-pass column assembly vs rebuilding the table per column (synthetic data)
+N_NUM, N_CAT, N_ROWS, REPEATS = 400, 200, 10_000, 5
+rng = np.random.default_rng(42)
+
+numericals, categoricals = [f'num_{i}' for i in range(N_NUM)], [f'cat_{i}' for i in range(N_CAT)]
+table = pa.table({
+    'sku_key': pa.array(np.arange(N_ROWS)),
+    **{col: pa.array(rng.normal(size=N_ROWS)) for col in numericals[:N_NUM // 2]},
+    **{col: pa.array(rng.choice(['a', 'b', 'c', None], N_ROWS)) for col in categoricals[:N_CAT // 2]},
+})
+base = pa.table({'sku_key': pa.array(rng.integers(0, N_ROWS, N_ROWS))})
+
+sts = ThorStarSchema(numericals=numericals, categoricals=categoricals, one_hots=[], label=None)
+
+def timing(func):
+    t = time.perf_counter()
+    for _ in range(REPEATS):
+        out = func()
+    return (time.perf_counter() - t) / REPEATS * 1e3, out
+
+def per_column(table, arrays): # REFERENCE: HOW COLUMNS WERE REPLACED BEFORE
+    for name, arr in arrays.items():
+        table = table.drop([name]).append_column(name, arr)
+    return table
+
+register, _ = timing(lambda: sts.register_table(name='skus', table=table, keys=['sku_key']))
+enrich, (_, X, _, _) = timing(lambda: sts.enrich(base))
+mutate, _ = timing(lambda: sts.cln.mutate(X))
+fill_nans, _ = timing(lambda: sts.cln.fill_nans(X))
+
+arrays = {col: X.column(col) for col in X.column_names}
+one_pass, _ = timing(lambda: replace_columns(X, arrays))
+rebuild, _ = timing(lambda: per_column(X, arrays))
+
+print(f"{len(sts.cln.features())} features, {N_ROWS} rows")
+print(f"register_table     {register:>9.1f} ms")
+print(f"enrich             {enrich:>9.1f} ms")
+print(f"mutate             {mutate:>9.1f} ms")
+print(f"fill_nans          {fill_nans:>9.1f} ms")
+print(f"replace one pass   {one_pass:>9.1f} ms")
+print(f"replace per column {rebuild:>9.1f} ms")
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as c
+
+from thor_mlops.clean import ThorTableCleaner
+from thor_mlops.ops import loads_json_column
+from thor_mlops.starschema import ThorStarSchema
+import synthetic
+
+# Benchmark suite for the cleaner and star schema hot paths
+#   python benchmarks/suite.py --save baseline.json
+#   python benchmarks/suite.py --compare baseline.json   (exits with 1 on regressions)
+
+def fitted_cleaner(table: pa.Table) -> ThorTableCleaner:
+    cln = ThorTableCleaner()
+    cln.register(numericals=[col for col in table.column_names if col.startswith('num_')], categoricals=[col for col in table.column_names if col.startswith('cat_')])
+    cln.transform(table)
+    return cln
+
+# EVERY CASE PREPARES ITS DATA AND RETURNS (NUMBER OF ROWS, FUNCTION TO TIME)
+def case_transform_wide(scale):
+    table = synthetic.wide_table(rows=int(10_000 * scale))
+    cln = fitted_cleaner(table)
+    return table.num_rows, lambda: cln.transform(table)
+
+def case_transform_tall(scale):
+    table = synthetic.tall_table(rows=int(1_000_000 * scale))
+    cln = fitted_cleaner(table)
+    return table.num_rows, lambda: cln.transform(table)
+
+def case_transform_high_cardinality(scale):
+    table = synthetic.categorical_table(rows=int(500_000 * scale), cols=2, cardinality=int(100_000 * scale))
+    cln = fitted_cleaner(table)
+    return table.num_rows, lambda: cln.transform(table)
+
+def case_mutate(scale):
+    table = synthetic.wide_table(rows=int(10_000 * scale))
+    cln = fitted_cleaner(table)
+    X, _ = cln.transform(table)
+    return X.num_rows, lambda: cln.mutate(X, seed=0)
+
+def case_split(scale):
+    table = synthetic.tall_table(rows=int(1_000_000 * scale))
+    cln = fitted_cleaner(table)
+    X, y = cln.transform(table, label='num_0')
+    return X.num_rows, lambda: cln.split(X=X, y=y, perc=0.2)
+
+def case_loads_json_column(scale):
+    table = pa.table({'properties': synthetic.json_column(int(200_000 * scale))})
+    return table.num_rows, lambda: loads_json_column(table, column='properties', drop=True)
+
+def case_enrich(scale):
+    tables = synthetic.star_schema_tables(skus=int(200_000 * scale), base_rows=int(100_000 * scale))
+    sts = ThorStarSchema(
+        numericals=[f'sku_num_{i}' for i in range(4)] + ['sales', 'stock', 'properties/key_0', 'properties/key_1', 'margin'],
+        categoricals=['sku_name', 'properties/brand'] + [f'store_cat_{i}' for i in range(3)],
+        one_hots=['properties/season'],
+        label='stock',
+    )
+    sts.register_table(name='skus', table=tables['skus'], keys=['sku_key'], json_columns=['properties'])
+    sts.register_table(name='stores', table=tables['stores'], keys=['store_key'])
+    sts.register_table(name='sku_stores', table=tables['sku_stores'], keys=['sku_key', 'store_key'])
+    sts.register_calculation(name='margin', func=lambda t: c.subtract(t.column('sku_num_0_c'), t.column('sku_num_1_c')))
+    sts.enrich(tables['base'])
+    return tables['base'].num_rows, lambda: sts.enrich(tables['base'])
+
+def case_write_to_csv(scale):
+    table = synthetic.tall_table(rows=int(500_000 * scale))
+    cln = fitted_cleaner(table)
+    X, _ = cln.transform(table)
+    path = os.path.join(tempfile.mkdtemp(), 'train.csv')
+    return X.num_rows, lambda: cln.write_to_csv(table=cln.align(X=X), path=path)
+
+CASES = {name[5:]: func for name, func in globals().items() if name.startswith('case_')}
+
+def measure(run, rows: int, repeat: int) -> dict:
+    run() # WARMUP
+    timings = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - t)
+
+    # MEMORY IN A SEPARATE RUN, TRACING SLOWS DOWN THE TIMED RUNS
+    default = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(default)
+    pa.set_memory_pool(pool)
+    tracemalloc.start()
+    try:
+        run()
+        _, py_peak = tracemalloc.get_traced_memory()
+    finally:
+        pa.set_memory_pool(default)
+        tracemalloc.stop()
+
+    seconds = float(np.median(timings))
+    return {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds,
+        'arrow_peak_bytes': pool.max_memory(),
+        'arrow_allocated_bytes': pool.total_bytes_allocated(),
+        'arrow_allocations': pool.num_allocations(),
+        'python_peak_bytes': py_peak,
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        b = baseline[name]
+        if r['rows_per_second'] < b['rows_per_second'] * (1 - threshold):
+            regressions.append(f"{name}: {r['rows_per_second']:,.0f} rows/s vs {b['rows_per_second']:,.0f} baseline")
+        peak, base_peak = r['arrow_peak_bytes'] + r['python_peak_bytes'], b['arrow_peak_bytes'] + b['python_peak_bytes']
+        if peak > base_peak * (1 + threshold):
+            regressions.append(f"{name}: peak memory {peak / 2 ** 20:,.1f} MB vs {base_peak / 2 ** 20:,.1f} MB baseline")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark suite for the cleaner and star schema hot paths")
+    parser.add_argument('--cases', nargs='*', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier for the data sizes")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help="write results to this json file")
+    parser.add_argument('--compare', help="baseline json file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15, help="allowed relative slowdown / memory growth")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':<28} {'rows/s':>14} {'seconds':>9} {'arrow peak MB':>14} {'python peak MB':>15} {'allocations':>12}")
+    for name in args.cases:
+        rows, run = CASES[name](args.scale)
+        r = results[name] = measure(run, rows=rows, repeat=args.repeat)
+        print(f"{name:<28} {r['rows_per_second']:>14,.0f} {r['seconds']:>9.3f} {r['arrow_peak_bytes'] / 2 ** 20:>14.1f} {r['python_peak_bytes'] / 2 ** 20:>15.1f} {r['arrow_allocations']:>12,}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'pyarrow': pa.__version__, 'scale': args.scale, 'results': results}, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print(f"Warning: baseline was measured at scale {baseline.get('scale')}")
+        regressions = compare(results, baseline['results'], threshold=args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,47 @@
+import json
+import numpy as np
+import pyarrow as pa
+
+# Synthetic data generators for the benchmarks (deterministic per seed)
+def numerical_table(rows: int, cols: int, null_frac: float = 0.05, prefix: str = 'num_', seed: int = 0) -> pa.Table:
+    rng = np.random.default_rng(seed)
+    return pa.table({f'{prefix}{i}': pa.array(rng.normal(loc=i, scale=1 + i % 7, size=rows), mask=(rng.random(rows) < null_frac)) for i in range(cols)})
+
+def categorical_table(rows: int, cols: int, cardinality: int = 10, null_frac: float = 0.05, prefix: str = 'cat_', seed: int = 0) -> pa.Table:
+    rng = np.random.default_rng(seed)
+    values = pa.array([f'value {i}' for i in range(cardinality)])
+    return pa.table({f'{prefix}{i}': values.take(pa.array(rng.integers(0, cardinality, rows), mask=(rng.random(rows) < null_frac))) for i in range(cols)})
+
+def json_column(rows: int, keys: int = 10, seed: int = 0) -> pa.array:
+    rng = np.random.default_rng(seed)
+    brands, seasons = [f'brand {i}' for i in range(100)], ['SS', 'AW', 'NOOS']
+    docs = []
+    for i in range(rows):
+        doc = {f'key_{k}': float(v) for k, v in enumerate(rng.normal(size=keys - 2))}
+        doc['brand'], doc['season'] = brands[i % len(brands)], seasons[i % len(seasons)]
+        docs.append(json.dumps(doc))
+    return pa.array(docs)
+
+def wide_table(rows: int = 10_000, numericals: int = 400, categoricals: int = 200, seed: int = 0) -> pa.Table:
+    num, cat = numerical_table(rows, numericals, seed=seed), categorical_table(rows, categoricals, seed=seed + 1)
+    return pa.Table.from_arrays(num.columns + cat.columns, names=num.column_names + cat.column_names)
+
+def tall_table(rows: int = 2_000_000, numericals: int = 6, categoricals: int = 4, seed: int = 0) -> pa.Table:
+    return wide_table(rows=rows, numericals=numericals, categoricals=categoricals, seed=seed)
+
+def star_schema_tables(skus: int = 200_000, stores: int = 500, base_rows: int = 100_000, seed: int = 0) -> dict:
+    # SKU DIMENSION (WITH JSON PROPERTIES), STORE DIMENSION, SKU x STORE FACTS AND A STOCK BASE TABLE
+    rng = np.random.default_rng(seed)
+    t_sk = pa.Table.from_arrays(
+        [pa.array(np.arange(skus)), pa.array([f'sku {i}' for i in range(skus)]), json_column(skus, keys=6, seed=seed)] + numerical_table(skus, 4, prefix='sku_num_', seed=seed).columns,
+        names=['sku_key', 'sku_name', 'properties'] + [f'sku_num_{i}' for i in range(4)],
+    )
+    t_st = pa.Table.from_arrays([pa.array(np.arange(stores))] + categorical_table(stores, 3, prefix='store_cat_', seed=seed).columns, names=['store_key'] + [f'store_cat_{i}' for i in range(3)])
+    n_ss = min(skus, 10_000) * min(stores, 50)
+    t_ss = pa.table({
+        'sku_key': pa.array(np.repeat(np.arange(min(skus, 10_000)), min(stores, 50))),
+        'store_key': pa.array(np.tile(np.arange(min(stores, 50)), min(skus, 10_000))),
+        'sales': pa.array(rng.poisson(2, n_ss).astype(np.float64)),
+    })
+    base = pa.table({'sku_key': pa.array(rng.integers(0, skus, base_rows)), 'store_key': pa.array(rng.integers(0, stores, base_rows)), 'stock': pa.array(rng.integers(0, 20, base_rows))})
+    return {'skus': t_sk, 'stores': t_st, 'sku_stores': t_ss, 'base': base}
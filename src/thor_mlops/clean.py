@@ -1,45 +1,166 @@
+import os
 import json
 import numpy as np
 import pyarrow as pa
 import pyarrow.compute as c
 import pyarrow.csv as csv
-from typing import List, Tuple, Union
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple, Union
+
+from thor_mlops.ops import iter_batches, replace_columns, string_buffer, values_digest, Vocabulary
+from thor_mlops.metrics import ThorMetrics, NULL_METRICS
+from thor_mlops.sketch import QuantileSketch, CategorySketch, hash_strings
 
 # Cleaning functions
-def clean_numerical(arr: pa.array, impute: float = 0.0, clip_min: float = None, clip_max: float = None) -> pa.array:
+def clean_numerical(arr: pa.array, impute: float = 0.0, clip_min: float = None, clip_max: float = None, ndigits: int = 5) -> pa.array:
     arr = arr.cast(pa.float32())
     if clip_min: arr = c.if_else(c.greater(arr, pa.scalar(clip_min)), arr, pa.scalar(clip_min))
     if clip_max: arr = c.if_else(c.less(arr, pa.scalar(clip_max)), arr, pa.scalar(clip_max))
-    return c.round(arr.fill_null(impute), ndigits=5)
+    arr = arr.fill_null(impute)
+    return (c.round(arr, ndigits=ndigits) if ndigits is not None else arr)
 
-def clean_categorical(arr: pa.array, categories: List[str] = []) -> Tuple[pa.array, List[str]]:
-    arr = arr.cast(pa.string()).dictionary_encode()
-    dic = arr.dictionary.to_pylist()
-    if categories:
-        dmap = [(categories.index(v) + 1 if v in categories else 0) for v in dic]
-        return (c.take(pa.array(dmap), arr.indices), categories)
-    else:
-        return (c.add(arr.indices, pa.scalar(1)).fill_null(0), dic)
+def category_index(arr: pa.array, vocabulary: Vocabulary) -> pa.array:
+    # LOOKUP OF THE (SMALL) DICTIONARY IN THE PERSISTENT VOCABULARY, THEN ONE TAKE OVER THE INDICES
+    dmap, indices = vocabulary.positions(arr)
+    return c.take(dmap, indices)
 
-def clean_onehot(arr: pa.array, categories: List[str] = [], drop_first: bool = False) -> Tuple[pa.array, List[str]]:
-    arr = arr.cast(pa.string())
+def clean_categorical(arr: pa.array, categories: List[str] = [], vocabulary: Vocabulary = None) -> Tuple[pa.array, List[str]]:
     if categories:
-        clns =[c.equal(arr, v).fill_null(False) for v in categories]
+        vocabulary = (vocabulary if vocabulary is not None else Vocabulary(pa.array(categories, pa.string())))
+        return (vocabulary.codes(arr), categories)
     else:
-        categories = [u for u in arr.unique().to_pylist() if u]
-        clns = [c.equal(arr, v).fill_null(False) for v in categories]
-    return clns[(1 if drop_first else 0):], categories[(1 if drop_first else 0):]
+        arr = arr.cast(pa.string()).dictionary_encode()
+        return (c.add(arr.indices, pa.scalar(1)).fill_null(0), arr.dictionary.to_pylist())
+
+def onehot_positions(arr: pa.array, categories: List[str], vocabulary: Vocabulary = None, drop_first: bool = False) -> np.ndarray:
+    vocabulary = (vocabulary if vocabulary is not None else Vocabulary(pa.array(categories, pa.string())))
+    pos = category_index(arr, vocabulary).fill_null(-1).to_numpy(zero_copy_only=False)
+    return (pos - 1 if drop_first else pos) # -1 MEANS NO HOT COLUMN
+
+def clean_onehot(arr: pa.array, categories: List[str] = [], drop_first: bool = False, vocabulary: Vocabulary = None) -> Tuple[pa.array, List[str]]:
+    if not categories:
+        categories = [u for u in arr.cast(pa.string()).unique().to_pylist() if u]
+        vocabulary = None
+    pos = onehot_positions(arr, categories, vocabulary=vocabulary, drop_first=drop_first)
+    categories = categories[(1 if drop_first else 0):]
+
+    return onehot_bitmaps(pos, len(categories)), categories
+
+def onehot_bitmaps(pos: np.ndarray, n: int, chunk_bytes: int = 1 << 24) -> List[pa.array]:
+    # ONE BOOLEAN ARRAY PER POSITION 0..n-1 (-1 MEANS NO HOT COLUMN), ALL ROWS ARE SCATTERED IN ONE PASS INSTEAD OF ONE EQUALITY PASS PER CATEGORY
+    # THE BYTE PER CELL SCATTER MATRIX ONLY COVERS A CHUNK OF ROWS, WHICH IS PACKED INTO THE ARROW BITMAPS (ONE BIT PER CELL) RIGHT AWAY
+    rows = len(pos)
+    bits = np.zeros((n, (rows + 7) // 8), dtype=np.uint8)
+    step = max(chunk_bytes // max(n, 1) // 8 * 8, 8)
+    for start in range(0, rows, step):
+        chunk = pos[start:start + step]
+        hot = np.zeros((n, len(chunk)), dtype=bool)
+        hit = np.nonzero(chunk >= 0)[0]
+        hot[chunk[hit], hit] = True
+        bits[:, start // 8:(start + len(chunk) + 7) // 8] = np.packbits(hot, axis=1, bitorder='little')
+    return [pa.Array.from_buffers(pa.bool_(), rows, [None, pa.py_buffer(b)]) for b in bits]
+
+def clean_onehot_csr(arr: pa.array, categories: List[str], drop_first: bool = False, vocabulary: Vocabulary = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (data, indices, indptr) AS ACCEPTED BY scipy.sparse.csr_matrix, SHAPE IS (len(arr), len(categories))
+    pos = onehot_positions(arr, categories, vocabulary=vocabulary, drop_first=drop_first)
+    valid = pos >= 0
+    indptr = np.zeros(len(pos) + 1, dtype=np.int64)
+    np.cumsum(valid, out=indptr[1:])
+    return np.ones(indptr[-1], dtype=np.float32), pos[valid].astype(np.int32), indptr
+
+def feature_codes(arr: Union[pa.array, pa.ChunkedArray]) -> Union[pa.array, pa.ChunkedArray]:
+    # DICTIONARY (ONE-HOT) FEATURES AS CATEGORICAL CODES: DICTIONARY INDEX + 1, 0 WHEN NOTHING IS HOT, OTHER FEATURES AS THEY ARE
+    if not pa.types.is_dictionary(arr.type):
+        return arr
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr)
+    return c.add(arr.indices.cast(pa.int64()), pa.scalar(1)).fill_null(0)
+
+# Output types of cleaned features
+class DtypePolicy():
+    FLOATS = {'float32': pa.float32(), 'float16': pa.float16(), 'uint8': pa.uint8(), 'uint16': pa.uint16()}
+    FLOAT16_MAX = 65504.0
+    INTEGERS = ((pa.int8(), 7), (pa.int16(), 15), (pa.int32(), 31), (pa.int64(), 63))
+
+    def __init__(self, integers: str = 'int64', floats: str = None, rounding: bool = True, one_hot: str = 'bool'):
+        # integers: 'int64' OR 'smallest' (int8 / int16 / int32 FROM THE VOCABULARY SIZE, MISSING ONE-HOT FEATURES BECOME BOOLEAN)
+        # floats: None (AS CLEANED), 'float32', 'float16' OR 'uint8' / 'uint16' (LINEAR QUANTIZATION BETWEEN THE MEASURED MIN & MAX, VALUES OUTSIDE SATURATE)
+        #   float16 KEEPS 11 SIGNIFICANT BITS (A VALUE NEAR 1000 IS ONLY PRECISE TO 0.5), COLUMNS MEASURED OUTSIDE +-65504 STAY float32
+        # rounding: ROUND NUMERICALS TO 5 DIGITS, SKIPPING IT SAVES A PASS OVER EVERY NUMERICAL
+        # one_hot: 'bool' (ONE BIT PACKED BOOLEAN COLUMN PER CATEGORY) OR 'dictionary' (ONE DICTIONARY ENCODED COLUMN <name>_onehot, NULL WHEN NOTHING IS HOT)
+        if integers not in ('int64', 'smallest'):
+            raise Exception(f"{integers} is not a valid integer policy, use int64 or smallest")
+        if floats is not None and floats not in self.FLOATS:
+            raise Exception(f"{floats} is not a valid float policy, use one of {list(self.FLOATS)}")
+        if one_hot not in ('bool', 'dictionary'):
+            raise Exception(f"{one_hot} is not a valid one-hot layout, use bool or dictionary")
+        self.integers, self.floats, self.rounding, self.one_hot = integers, floats, rounding, one_hot
+
+    @classmethod
+    def compact(cls) -> 'DtypePolicy':
+        return cls(integers='smallest', floats='float16', rounding=False, one_hot='dictionary')
+
+    def ndigits(self) -> int:
+        return (5 if self.rounding else None)
+
+    def integer_type(self, n: int) -> pa.DataType:
+        # SMALLEST SIGNED TYPE HOLDING -n..n (SIGNED, SO NEGATIVE FILL VALUES AND DICTIONARY INDICES FIT)
+        if self.integers == 'int64':
+            return pa.int64()
+        return next(t for t, bits in self.INTEGERS if n < (1 << bits))
+
+    def quantized(self) -> bool:
+        return self.floats in ('uint8', 'uint16')
+
+    def float_encoder(self, col: 'NumericalColumn'):
+        # FUNCTION FROM A CLEANED NUMERICAL TO THE POLICY TYPE (None WHEN IT IS KEPT AS CLEANED), SCALARS ARE BUILT ONCE
+        if self.floats is None:
+            return None
+        t = self.FLOATS[self.floats]
+        if t == pa.float16() and max(abs(col.min), abs(col.max)) > self.FLOAT16_MAX: # WOULD BECOME inf
+            t = pa.float32()
+        if not self.quantized():
+            return lambda arr: arr.cast(t)
+        levels, span = float((1 << t.bit_width) - 1), col.max - col.min
+        offset, scale, zero, top = pa.scalar(float(col.min)), pa.scalar(levels / span if span > 0 else 0.0), pa.scalar(0.0), pa.scalar(levels)
+        def encode(arr):
+            q = c.round(c.multiply(c.subtract(arr.cast(pa.float64()), offset), scale))
+            return c.min_element_wise(c.max_element_wise(q, zero), top).cast(t) # NAN BECOMES 0
+        return encode
+
+    def float_decoder(self, col: 'NumericalColumn'):
+        # INVERSE OF float_encoder (UP TO PRECISION), BACK TO float32
+        if not self.quantized():
+            return lambda arr: arr.cast(pa.float32())
+        levels, span = float((1 << self.FLOATS[self.floats].bit_width) - 1), col.max - col.min
+        offset, scale = pa.scalar(float(col.min)), pa.scalar(span / levels)
+        return lambda arr: c.add(c.multiply(arr.cast(pa.float64()), scale), offset).cast(pa.float32())
+
+    def to_dict(self) -> dict:
+        return {"integers": self.integers, "floats": self.floats, "rounding": self.rounding, "one_hot": self.one_hot}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'DtypePolicy':
+        return cls(**state)
+
+DEFAULT_POLICY = DtypePolicy()
 
 # Cleaning Classes
 class NumericalColumn():
-    def __init__(self, name: str, impute: str = 'fill', clip: bool = False, v_min: float = None, v_mean: float = None, v_stddev: float = None, v_max: float = None,  mutate_perc: float = 0.0, fill_value: int = -1):
+    policy = DEFAULT_POLICY # SET BY THE CLEANER
+
+    def __init__(self, name: str, impute: str = 'fill', clip: bool = False, v_min: float = None, v_mean: float = None, v_stddev: float = None, v_max: float = None, v_count: int = 0, v_median: float = None, sketch: Union[bool, dict] = False, mutate_perc: float = 0.0, fill_value: int = -1):
         self.name, self.impute, self.clip = name, impute, clip
-        self.measured = any((v_min, v_mean, v_max))
-        self.mean, self.stddev, self.min, self.max = (v_mean or 0), (v_stddev or 0), (v_min or 0), (v_max or 0)
+        self.measured = bool(v_count) or any((v_min, v_mean, v_max))
+        self.mean, self.stddev, self.min, self.max, self.count, self.median = [(v if v is not None else 0) for v in (v_mean, v_stddev, v_min, v_max, v_count, v_median)]
         self.mutate_perc, self.fill_value = mutate_perc, fill_value
 
+        # MERGEABLE QUANTILE SKETCH, ALWAYS KEPT FOR MEDIAN IMPUTATION
+        self.sketch = (QuantileSketch.from_dict(sketch) if isinstance(sketch, dict) else QuantileSketch() if sketch or impute == 'median' else None)
+
     def to_dict(self) -> dict:
-        return {"name": self.name, "type": "numerical", "impute": self.impute, "clip": self.clip, "v_min": self.min, "v_mean": self.mean, "v_stddev": self.stddev, "v_max": self.max, "mutate_perc": self.mutate_perc, "fill_value": self.fill_value}
+        return {"name": self.name, "type": "numerical", "impute": self.impute, "clip": self.clip, "v_min": self.min, "v_mean": self.mean, "v_stddev": self.stddev, "v_max": self.max, "v_count": self.count, "v_median": self.median, "sketch": (self.sketch.to_dict() if self.sketch is not None else False), "mutate_perc": self.mutate_perc, "fill_value": self.fill_value}
 
     def update(self, arr: pa.array):
         arr = arr.cast(pa.float32())
@@ -47,6 +168,49 @@ class NumericalColumn():
         self.stddev = float(c.stddev(arr).as_py())
         minmax = c.min_max(arr)
         self.min, self.max = float(minmax['min'].as_py()), float(minmax['max'].as_py())
+        self.count = len(arr) - arr.null_count
+        if self.sketch is not None:
+            self.sketch = QuantileSketch(compression=self.sketch.compression)
+            self.update_sketch(arr)
+
+    def update_sketch(self, arr: pa.array):
+        self.sketch.update(arr)
+        self.median = self.sketch.quantile(0.5)
+
+    def quantile(self, q: float) -> float:
+        if self.sketch is None:
+            raise Exception(f"{self.name} has no quantile sketch, register it with sketch=True")
+        return self.sketch.quantile(q)
+
+    def merge(self, count: int, mean: float, stddev: float, v_min: float, v_max: float):
+        # COMBINE MOMENTS OF TWO PARTITIONS (CHAN ET AL.), STDDEV IS THE POPULATION STDDEV LIKE c.stddev
+        if count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.stddev, self.min, self.max = count, mean, stddev, v_min, v_max
+            return
+        n = self.count + count
+        delta = mean - self.mean
+        m2 = self.stddev ** 2 * self.count + stddev ** 2 * count + delta ** 2 * self.count * count / n
+        self.count, self.mean, self.stddev = n, self.mean + delta * count / n, float(np.sqrt(m2 / n))
+        self.min, self.max = min(self.min, v_min), max(self.max, v_max)
+
+    def partial_update(self, arr: pa.array):
+        arr = arr.cast(pa.float32())
+        count = len(arr) - arr.null_count
+        if count == 0:
+            return
+        minmax = c.min_max(arr)
+        self.merge(count=count, mean=float(c.mean(arr).as_py()), stddev=float(c.stddev(arr).as_py()), v_min=float(minmax['min'].as_py()), v_max=float(minmax['max'].as_py()))
+        if self.sketch is not None:
+            self.update_sketch(arr)
+
+    def merge_state(self, other: 'NumericalColumn'):
+        # COMBINE A PARTIAL FIT OF THE SAME COLUMN (E.G. FROM ANOTHER SHARD OR PROCESS)
+        self.merge(count=other.count, mean=other.mean, stddev=other.stddev, v_min=other.min, v_max=other.max)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+            self.median = self.sketch.quantile(0.5)
 
     def features(self):
         return [self.name]
@@ -63,50 +227,260 @@ class NumericalColumn():
         if not self.measured:
             self.update(arr)
             self.measured = True
-        cln = clean_numerical(arr, impute=self.value(), clip_min=(self.min if self.clip else None), clip_max=(self.max if self.clip else None))
-        return cln
+        cln = clean_numerical(arr, impute=self.value(), clip_min=(self.min if self.clip else None), clip_max=(self.max if self.clip else None), ndigits=self.policy.ndigits())
+        return self.encode(cln)
+
+    def encode(self, arr: pa.array) -> pa.array:
+        encode = self.policy.float_encoder(self)
+        return (encode(arr) if encode is not None else arr)
+
+    def decode(self, arr: pa.array) -> pa.array:
+        return (self.policy.float_decoder(self)(arr) if self.policy.floats is not None else arr)
+
+    def fill(self, n: int) -> pa.array:
+        # MISSING FEATURE, IN THE SAME TYPE AS THE CLEANED FEATURE
+        if self.policy.floats is None:
+            return pa.repeat(self.fill_value, n)
+        return pa.repeat(self.encode(pa.array([float(self.fill_value)], pa.float32()))[0], n)
 
-class CategoricalColumn():
-    def __init__(self, name: str, categories: List[str] = [], mutate_perc: float = 0.0, fill_value: int = 0):
+class VocabularyColumn():
+    # VOCABULARY & SKETCH STATE SHARED BY CategoricalColumn AND OneHotColumn
+    policy = DEFAULT_POLICY # SET BY THE CLEANER
+    TYPE, EMPTY = None, True # EMPTY: WHETHER '' IS A CATEGORY
+
+    def __init__(self, name: str, categories: List[str] = [], mutate_perc: float = 0.0, fill_value: int = 0, top_k: int = None, sketch: Union[bool, dict] = False):
         self.name, self.categories = name, categories
         self.measured = (True if categories else False)
         self.mutate_perc, self.fill_value = mutate_perc, fill_value
 
-    def to_dict(self) -> dict:
-        return {"name": self.name, "type": "categorical", "categories": self.categories, "mutate_perc": self.mutate_perc, "fill_value": self.fill_value}
+        # HEAVY HITTERS & DISTINCT COUNT SKETCH, top_k KEEPS ONLY THE MOST FREQUENT CATEGORIES
+        self.top_k = top_k
+        self.sketch = (CategorySketch.from_dict(sketch) if isinstance(sketch, dict) else CategorySketch(capacity=max(4 * top_k, 1024)) if sketch or top_k else None)
+
+    @property
+    def categories(self) -> List[str]:
+        # VOCABULARIES OF A LOADED BINARY CLEANER ARE ONLY TURNED INTO A LIST WHEN NEEDED
+        if self._categories is None:
+            self._categories = self.vocabulary.values.to_pylist()
+        return self._categories
+
+    @categories.setter
+    def categories(self, categories: List[str]):
+        self._categories, self.vocabulary, self.seen = categories, None, None
+
+    def set_vocabulary(self, vocabulary: Vocabulary):
+        self._categories, self.vocabulary, self.seen, self.measured = None, vocabulary, None, True
+
+    def vocab(self) -> Vocabulary:
+        # CACHED LOOKUP OF THE CATEGORIES, REBUILT WHEN THE CATEGORIES CHANGE
+        if self.vocabulary is None:
+            self.vocabulary = Vocabulary(pa.array(self.categories, pa.string()))
+        return self.vocabulary
+
+    def value_set(self) -> pa.array:
+        return self.vocab().values
+
+    def size(self) -> int:
+        return (len(self._categories) if self._categories is not None else len(self.vocabulary))
+
+    def code_type(self) -> pa.DataType:
+        return self.policy.integer_type(max(self.size(), abs(self.fill_value)))
+
+    def digest(self) -> str:
+        return values_digest(self.vocabulary.values if self.vocabulary is not None else pa.array(self._categories, pa.string()))
+
+    def to_dict(self, categories: bool = True) -> dict:
+        # categories=False REPLACES THE CATEGORIES WITH THEIR DIGEST (KEEPS LAZILY LOADED VOCABULARIES LAZY)
+        return {"name": self.name, "type": self.TYPE, "categories": (self.categories if categories else self.digest()), "mutate_perc": self.mutate_perc, "fill_value": self.fill_value, "top_k": self.top_k, "sketch": (self.sketch.to_dict() if self.sketch is not None else False)}
+
+    def cardinality(self) -> int:
+        return (self.sketch.cardinality() if self.sketch is not None else self.size())
+
+    def keep(self, values: List[str]) -> List[str]:
+        return [v for v in values if v is not None and (v or self.EMPTY)]
+
+    def extend(self, values: List[str]):
+        # APPEND NEW CATEGORIES (IN ORDER OF APPEARANCE), top_k REPLACES THEM WITH THE MOST FREQUENT ONES
+        if self.top_k:
+            self.categories = self.keep(self.sketch.top())[:self.top_k]
+            return
+        if self.seen is None: # BUILT ONCE PER FIT (ON AN OWN COPY OF THE CATEGORIES), LATER BATCHES ONLY LOOK UP THEIR OWN VALUES
+            self._categories = list(self.categories)
+            self.seen = set(self._categories)
+        new = [v for v in self.keep(values) if v not in self.seen]
+        if new:
+            self.seen.update(new)
+            self._categories.extend(new)
+            self.vocabulary = None
+
+    def partial_update(self, arr: pa.array):
+        if self.sketch is not None:
+            self.sketch.update(arr)
+        self.extend(arr.cast(pa.string()).unique().to_pylist())
+
+    def merge_state(self, other: 'VocabularyColumn'):
+        # COMBINE A PARTIAL FIT OF THE SAME COLUMN (E.G. FROM ANOTHER SHARD OR PROCESS)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        self.extend(other.categories)
+
+class CategoricalColumn(VocabularyColumn):
+    TYPE = 'categorical'
 
     def features(self):
         return [self.name]
 
+    def fill(self, n: int) -> pa.array:
+        # MISSING FEATURE, IN THE SAME TYPE AS THE CLEANED FEATURE
+        if self.policy.integers == 'int64':
+            return pa.repeat(self.fill_value, n)
+        return pa.repeat(pa.scalar(self.fill_value, self.code_type()), n)
+
     def clean(self, arr: pa.array) -> pa.array:
-        cln, cats = clean_categorical(arr, categories=self.categories)
+        if not self.measured and self.sketch is not None:
+            self.partial_update(arr)
+            self.measured = True
+        if self.measured and self.size():
+            return self.vocab().codes(arr, self.code_type())
+        cln, cats = clean_categorical(arr, categories=self.categories, vocabulary=(self.vocab() if self.categories else None))
         if not self.measured:
             self.categories = cats
             self.measured = True
-        return cln
+        return (cln if self.policy.integers == 'int64' else cln.cast(self.code_type()))
 
-class OneHotColumn():
-    def __init__(self, name: str, categories: List[str] = [], mutate_perc: float = 0.0, fill_value: int = 0):
-        self.name, self.categories = name, categories
-        self.measured = (True if categories else False)
-        self.mutate_perc, self.fill_value = mutate_perc, fill_value
-
-    def to_dict(self) -> dict:
-        return {"name": self.name, "type": "one_hot", "categories": self.categories, "mutate_perc": self.mutate_perc, "fill_value": self.fill_value}
+class OneHotColumn(VocabularyColumn):
+    TYPE, EMPTY = 'one_hot', False # NO COLUMN FOR EMPTY VALUES
 
     def features(self):
+        if self.policy.one_hot == 'dictionary': # NOT self.name, WHICH A CategoricalColumn OF THE SAME SOURCE COLUMN USES
+            return [self.name + '_onehot']
         return [self.name + '_' + cat for cat in self.categories]
 
+    def fill(self, n: int) -> pa.array:
+        # MISSING FEATURE (EVERY FEATURE OF THE COLUMN), IN THE SAME TYPE AS THE CLEANED FEATURES
+        if self.policy.one_hot == 'dictionary': # NOTHING HOT
+            return pa.DictionaryArray.from_arrays(pa.nulls(n, self.code_type()), self.value_set())
+        if self.policy.integers == 'int64':
+            return pa.repeat(self.fill_value, n)
+        return pa.repeat(pa.scalar(bool(self.fill_value)), n)
+
     def clean(self, arr: pa.array) -> pa.array:
-        cln, cats = clean_onehot(arr, categories=self.categories)
+        if not self.measured and (self.sketch is not None or self.policy.one_hot == 'dictionary'):
+            self.partial_update(arr)
+            self.measured = True
+        if self.policy.one_hot == 'dictionary':
+            return [self.vocab().dictionary(arr, self.code_type())]
+        cln, cats = clean_onehot(arr, categories=self.categories, vocabulary=(self.vocab() if self.categories else None))
         if not self.measured:
             self.categories = cats
             self.measured = True
         return cln
 
+    def clean_sparse(self, arr: pa.array) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if not self.measured:
+            self.partial_update(arr)
+            self.measured = True
+        return clean_onehot_csr(arr, categories=self.categories, vocabulary=self.vocab())
+
+# Compiled plan for low latency inference
+class CleanerPlan():
+    def __init__(self, cleaner: 'ThorTableCleaner'):
+        # UNMEASURED COLUMNS HAVE NO STATE TO FREEZE, THE PLAN TREATS THEM AS MISSING
+        self.columns = tuple(col for col in cleaner.columns if col.measured) # THE COLUMN OF EVERY STEP
+        self.steps = tuple((col.name, self.compile_fields(col, fn), fn) for col in self.columns for fn in [self.compile_column(col)])
+        self.schema = pa.schema([f for _, fields, _ in self.steps for f in fields])
+
+    @staticmethod
+    def compile_fields(col: Union[NumericalColumn, CategoricalColumn, OneHotColumn], fn) -> Tuple[pa.Field]:
+        # DRY RUN ON AN EMPTY ARRAY TO FIND THE OUTPUT TYPES
+        arrays = fn(pa.array([], (pa.float64() if isinstance(col, NumericalColumn) else pa.string())))
+        return tuple(pa.field(feat, arr.type) for feat, arr in zip(col.features(), arrays))
+
+    @staticmethod
+    def compile_column(col: Union[NumericalColumn, CategoricalColumn, OneHotColumn]):
+        if isinstance(col, NumericalColumn):
+            # SAME STEPS AS clean_numerical, BUT WITH SCALARS BUILT ONCE (pa.scalar IS SLOW ON PYTHON VALUES)
+            clip_min, clip_max = (col.min if col.clip else None), (col.max if col.clip else None)
+            lo, hi = (pa.scalar(clip_min) if clip_min else None), (pa.scalar(clip_max) if clip_max else None)
+            impute, ndigits = pa.scalar(col.value(), (pa.float64() if lo is not None or hi is not None else pa.float32())), col.policy.ndigits()
+            rounding, policy = (c.RoundOptions(ndigits=ndigits) if ndigits is not None else None), col.policy.float_encoder(col)
+            def encode(arr):
+                arr = arr.cast(pa.float32())
+                if lo is not None: arr = c.if_else(c.greater(arr, lo), arr, lo)
+                if hi is not None: arr = c.if_else(c.less(arr, hi), arr, hi)
+                arr = arr.fill_null(impute)
+                if rounding is not None: arr = c.round(arr, options=rounding)
+                return [(policy(arr) if policy is not None else arr)]
+            return encode
+
+        vocab = col.vocab()
+        vocab.sorted_order() # SORTED ONCE AT COMPILE TIME, SMALL BATCHES ONLY BINARY SEARCH THEIR OWN VALUES (BULK BATCHES USE index_in)
+        n, code_type = len(vocab), col.code_type()
+        if isinstance(col, CategoricalColumn):
+            def encode(arr):
+                return [vocab.codes(arr, code_type)]
+        elif col.policy.one_hot == 'dictionary':
+            index_type = code_type
+            def encode(arr):
+                return [vocab.dictionary(arr, index_type)]
+        else:
+            def encode(arr):
+                dmap, indices = vocab.positions(arr)
+                pos = c.take(dmap, indices).fill_null(-1).to_numpy(zero_copy_only=False)
+                return onehot_bitmaps(pos, n)
+        return encode
+
+    def step(self, name: str):
+        return next((fn for n, _, fn in self.steps if n == name), None)
+
+    def transform(self, table: pa.Table, label: str = None) -> Tuple[pa.Table, pa.array]:
+        present = set(table.schema.names)
+        steps = [step for step in self.steps if step[0] in present] # SKIP MISSING COLUMNS LIKE ThorTableCleaner.transform
+        arrays = [a for name, _, fn in steps for a in fn(table.column(name).combine_chunks())]
+        schema = (self.schema if len(steps) == len(self.steps) else pa.schema([f for _, fields, _ in steps for f in fields]))
+        return pa.Table.from_arrays(arrays, schema=schema), (table.column(label) if label else None)
+
+# Deterministic fold assignment for streaming splits
+def hash_uniform(arr: pa.array, seed: int = 0) -> np.ndarray:
+    # SAME VALUE -> SAME NUMBER IN [0, 1) FOR A GIVEN seed, HASHING EVERY DISTINCT VALUE ONCE
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr).cast(pa.string()).fill_null('').dictionary_encode()
+    u = (hash_strings(arr.dictionary, seed=seed) >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+    return u[arr.indices.to_numpy(zero_copy_only=False)]
+
+class FoldAssigner():
+    GOLDEN = 0.6180339887498949
+
+    def __init__(self, folds: Union[int, Dict[str, float]] = {'train': 0.8, 'validation': 0.1, 'test': 0.1}, key: str = None, stratify: str = None, seed: int = 0):
+        # key: ROWS WITH THE SAME VALUE SHARE A FOLD (ROW ID, OR A GROUP LIKE A STORE), stratify: SAME FOLD PROPORTIONS WITHIN EVERY CLASS, OTHERWISE SEEDED RANDOM
+        if key and stratify:
+            raise Exception("Use either key (grouping) or stratify, not both")
+        folds = ({f'fold_{i}': 1 / folds for i in range(folds)} if isinstance(folds, int) else folds)
+        self.names, self.key, self.stratify, self.seed = list(folds.keys()), key, stratify, seed
+        fractions = np.array(list(folds.values()), dtype=np.float64)
+        self.bounds = np.cumsum(fractions / fractions.sum())[:-1]
+        self.rng, self.counts = np.random.default_rng(seed), {}
+
+    def assign(self, table: pa.Table) -> np.ndarray:
+        # FOLD NUMBER PER ROW, BATCHES MUST BE ASSIGNED IN STREAM ORDER (RANDOM DRAWS AND STRATUM COUNTS CONTINUE ACROSS BATCHES)
+        if self.key:
+            u = hash_uniform(table.column(self.key), seed=self.seed)
+        elif self.stratify:
+            # EVERY STRATUM WALKS A GOLDEN RATIO SEQUENCE (STARTING AT A HASH OF THE STRATUM), WHICH HITS THE FRACTIONS ALMOST EXACTLY
+            strata = table.column(self.stratify).combine_chunks().cast(pa.string()).fill_null('').dictionary_encode()
+            codes, starts = strata.indices.to_numpy(zero_copy_only=False), hash_uniform(strata.dictionary, seed=self.seed)
+            u = np.empty(table.num_rows, dtype=np.float64)
+            for i, value in enumerate(strata.dictionary.to_pylist()):
+                rows = np.nonzero(codes == i)[0]
+                seen = self.counts.get(value, 0)
+                u[rows] = (starts[i] + (seen + 1 + np.arange(len(rows))) * self.GOLDEN) % 1.0
+                self.counts[value] = seen + len(rows)
+        else:
+            u = self.rng.random(table.num_rows)
+        return np.searchsorted(self.bounds, u, side='right')
+
 class ThorTableCleaner():
-    def __init__(self):
-        self.columns = []
+    def __init__(self, policy: DtypePolicy = None):
+        self.columns, self.policy = [], (policy or DEFAULT_POLICY)
     
     # HANDY FUNCTIONS
     def names(self):
@@ -117,36 +491,73 @@ class ThorTableCleaner():
 
     def uninitialized(self):
         return [col.name for col in self.columns if not col.measured]
+
+    def set_policy(self, policy: DtypePolicy):
+        # OUTPUT TYPES OF ALL (ALSO ALREADY REGISTERED) COLUMNS, TABLES CLEANED BEFORE KEEP THEIR TYPES
+        self.policy = policy
+        for col in self.columns:
+            col.policy = policy
     
     # REGISTERING COLUMNS
-    def register_numerical(self, name: str, impute: str = 'mean', clip: bool = True, mutate_perc: float = 0.1, fill_value: int = -1):
-        self.columns.append(NumericalColumn(name=name, impute=impute, clip=clip, mutate_perc=mutate_perc, fill_value=fill_value))
+    def add(self, column: Union[NumericalColumn, CategoricalColumn, OneHotColumn]):
+        column.policy = self.policy
+        self.columns.append(column)
+
+    def register_numerical(self, name: str, impute: str = 'mean', clip: bool = True, mutate_perc: float = 0.1, fill_value: int = -1, sketch: bool = False):
+        self.add(NumericalColumn(name=name, impute=impute, clip=clip, mutate_perc=mutate_perc, fill_value=fill_value, sketch=sketch))
 
-    def register_categorical(self, name: str, categories: List[str] = [], mutate_perc: float = 0.1, fill_value: int = 0):
-        self.columns.append(CategoricalColumn(name=name, categories=categories, mutate_perc=mutate_perc, fill_value=fill_value))
+    def register_categorical(self, name: str, categories: List[str] = [], mutate_perc: float = 0.1, fill_value: int = 0, top_k: int = None, sketch: bool = False):
+        self.add(CategoricalColumn(name=name, categories=categories, mutate_perc=mutate_perc, fill_value=fill_value, top_k=top_k, sketch=sketch))
     
-    def register_one_hot(self, name: str, categories: List[str] = [], mutate_perc: float = 0.1, fill_value: int = 0):
-        self.columns.append(OneHotColumn(name=name, categories=categories, mutate_perc=mutate_perc, fill_value=fill_value)) 
+    def register_one_hot(self, name: str, categories: List[str] = [], mutate_perc: float = 0.1, fill_value: int = 0, top_k: int = None, sketch: bool = False):
+        self.add(OneHotColumn(name=name, categories=categories, mutate_perc=mutate_perc, fill_value=fill_value, top_k=top_k, sketch=sketch)) 
 
     def register(self, numericals: List[str] = [], categoricals: List[str] = [], one_hots: List[str] = []):
         [self.register_numerical(c) for c in numericals], [self.register_categorical(c) for c in categoricals], [self.register_one_hot(c) for c in one_hots]
 
     # CLEANING
-    def clean_column(self, table: pa.Table, column: Union[NumericalColumn, CategoricalColumn, OneHotColumn]) -> Tuple[List[str], List[pa.array]]:
-        cln = column.clean(table.column(column.name).combine_chunks())
+    def clean_column(self, table: pa.Table, column: Union[NumericalColumn, CategoricalColumn, OneHotColumn], offset: int = 0, length: int = None, metrics: ThorMetrics = NULL_METRICS) -> Tuple[List[str], List[pa.array]]:
+        arr = table.column(column.name).slice(offset, length)
+        with metrics.stage('clean', column.name, rows_in=len(arr)):
+            cln = column.clean(arr.combine_chunks())
         if isinstance(column, OneHotColumn):
-            return [column.name + '_' + cat for cat in column.categories], cln
+            return column.features(), cln
         else:
             return [column.name], [cln]
 
-    def transform(self, table: pa.Table, label: str = None, warn_missing: bool = True) -> Tuple[pa.Table, pa.array]:
-        keys, arrays = [], []
+    def clean_columns_parallel(self, table: pa.Table, columns: list, workers: int, chunk_size: int = None, metrics: ThorMetrics = NULL_METRICS) -> List[Tuple[List[str], List[pa.array]]]:
+        # SPLIT MEASURED COLUMNS INTO ROW CHUNKS, UNMEASURED COLUMNS ARE MEASURED ON THE FULL COLUMN
+        tasks = []
+        for column in columns:
+            if chunk_size and column.measured and table.num_rows > chunk_size:
+                tasks.append([(column, offset, chunk_size) for offset in range(0, table.num_rows, chunk_size)])
+            else:
+                tasks.append([(column, 0, None)])
+
+        # ARROW COMPUTE RELEASES THE GIL, SO THREADS CLEAN COLUMNS / CHUNKS CONCURRENTLY
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [[executor.submit(self.clean_column, table, *task, metrics=metrics) for task in chunks] for chunks in tasks]
+            results = [[f.result() for f in chunks] for chunks in futures]
+
+        # GLUE CHUNKS BACK TOGETHER IN ROW ORDER
+        return [(chunks[0][0], [pa.concat_arrays(list(arrs)) for arrs in zip(*[a for _, a in chunks])]) if len(chunks) > 1 else chunks[0] for chunks in results]
+
+    def transform(self, table: pa.Table, label: str = None, warn_missing: bool = True, workers: int = 1, chunk_size: int = None, metrics: ThorMetrics = NULL_METRICS) -> Tuple[pa.Table, pa.array]:
+        columns = []
         for column in self.columns:
             if column.name not in table.column_names:
                 if warn_missing:
                     print(f"{column.name} is missing in table.")
                 continue
-            k, a = self.clean_column(table, column)
+            columns.append(column)
+
+        if workers > 1:
+            results = self.clean_columns_parallel(table, columns, workers=workers, chunk_size=chunk_size, metrics=metrics)
+        else:
+            results = [self.clean_column(table, column, metrics=metrics) for column in columns]
+
+        keys, arrays = [], []
+        for k, a in results:
             keys.extend(k)
             arrays.extend(a)
         return pa.Table.from_arrays(arrays, names=keys), (table.column(label) if label else None)
@@ -155,6 +566,43 @@ class ThorTableCleaner():
         self.register(numericals=numericals, categoricals=categoricals, one_hots=one_hots)
         return self.transform(table=table, label=label)
 
+    # STREAMING (OUT-OF-CORE)
+    def fit_stream(self, source, batch_size: int = None, sample: float = None, seed: int = None) -> 'ThorTableCleaner':
+        # ACCUMULATE STATISTICS OF UNMEASURED COLUMNS OVER A DATASET / TABLE / RECORDBATCH ITERATOR
+        # sample FITS ON A RANDOM FRACTION OF THE ROWS (MIN / MAX AND RARE CATEGORIES BECOME APPROXIMATE)
+        # COLUMNS THAT NEVER SHOW UP IN THE SOURCE (E.G. CALCULATIONS) STAY UNMEASURED
+        columns, rng, seen = [col for col in self.columns if not col.measured], np.random.default_rng(seed), set()
+        for batch in iter_batches(source, columns=[col.name for col in columns], batch_size=batch_size):
+            if sample is not None and sample < 1:
+                batch = batch.filter(pa.array(rng.random(batch.num_rows) < sample))
+            for col in columns:
+                if col.name in batch.schema.names:
+                    col.partial_update(batch.column(col.name))
+                    seen.add(col.name)
+        for col in columns:
+            if col.name in seen:
+                col.measured = True
+        return self
+
+    def merge(self, other: 'ThorTableCleaner') -> 'ThorTableCleaner':
+        # COMBINE PARTIAL FITS OF SHARDS / PROCESSES (E.G. ThorTableCleaner.from_json OF EVERY WORKER) COLUMN BY COLUMN
+        others = {col.name: col for col in other.columns}
+        for col in self.columns:
+            if col.name in others and others[col.name].measured:
+                col.merge_state(others[col.name])
+                col.measured = True
+        return self
+
+    def transform_stream(self, source, label: str = None, warn_missing: bool = True, batch_size: int = None, workers: int = 1) -> Iterator[Tuple[pa.Table, pa.array]]:
+        # YIELD CLEANED BATCHES, UNMEASURED COLUMNS ARE MEASURED ON THE FIRST BATCH (USE fit_stream FIRST)
+        columns = list(dict.fromkeys(self.names() + ([label] if label else []))) # A DATASET PROJECTION MUST NOT REPEAT A COLUMN
+        for batch in iter_batches(source, columns=columns, batch_size=batch_size):
+            yield self.transform(table=pa.Table.from_batches([batch]), label=label, warn_missing=warn_missing, workers=workers)
+            warn_missing = False
+
+    def compile(self) -> CleanerPlan:
+        return CleanerPlan(self)
+
     # ML OPS
     def random_mask(self, n, perc):
         return c.greater(pa.array(np.random.uniform(size=n)), pa.scalar(perc))
@@ -162,35 +610,102 @@ class ThorTableCleaner():
     def random_int(self, n, low, high):
         return pa.array(np.random.randint(low, high=high, size=n))
 
-    def mutate(self, table: pa.Table) -> pa.Table:
-        for col in self.columns:
-            if isinstance(col, OneHotColumn):
-                continue
-            elif isinstance(col, CategoricalColumn):
-                arr = table.column(col.name)
-                arr = c.if_else(self.random_mask(n=table.num_rows, perc=(col.mutate_perc / 2)), arr, self.random_int(n=table.num_rows, low=0, high=len(col.categories) + 1)) # 50%: SWAP RANDOMLY
-                arr = c.if_else(self.random_mask(n=table.num_rows, perc=(col.mutate_perc / 2)), arr, pa.scalar(col.fill_value)) # 50%: FILL 0 (UNKNOWN)
-            elif isinstance(col, NumericalColumn):
-                noise = np.random.normal(loc=0.0, scale=0.05 * col.stddev, size=table.num_rows)
-                arr = c.add(table.column(col.name), pa.array(noise, type=pa.float32()))
-                arr = c.if_else(self.random_mask(n=table.num_rows, perc=col.mutate_perc), arr, pa.scalar(col.fill_value))
-            table = table.drop([col.name]).append_column(col.name, arr)
-        return table
+    def mutate(self, table: pa.Table, seed: int = None, rng: np.random.Generator = None) -> pa.Table:
+        # ALL RANDOMNESS COMES FROM ONE GENERATOR (REPRODUCIBLE WITH seed), DRAWN PER COLUMN SO ONLY ONE COLUMN OF RANDOM NUMBERS IS ALIVE AT A TIME
+        rng, n = (rng if rng is not None else np.random.default_rng(seed)), table.num_rows
+        arrays = {}
+        for col in [col for col in self.columns if isinstance(col, CategoricalColumn)]:
+            k = col.size()
+            arr = arrays.get(col.name, table.column(col.name))
+            arr = c.if_else(pa.array(rng.random(n, dtype=np.float32) > col.mutate_perc / 2), arr, pa.array(rng.integers(0, k + 1, n))) # 50%: SWAP RANDOMLY
+            arrays[col.name] = c.if_else(pa.array(rng.random(n, dtype=np.float32) > col.mutate_perc / 2), arr, pa.scalar(col.fill_value)) # 50%: FILL 0 (UNKNOWN)
+            if col.policy.integers != 'int64': arrays[col.name] = arrays[col.name].cast(col.code_type())
+        for col in [col for col in self.columns if isinstance(col, NumericalColumn)]:
+            # NOISE IS ADDED TO DECODED VALUES (float16 HAS NO ARITHMETIC, QUANTIZED CODES ARE NOT IN THE UNITS OF THE STDDEV)
+            arr = c.add(col.decode(arrays.get(col.name, table.column(col.name))), pa.array(rng.standard_normal(n, dtype=np.float32) * np.float32(0.05 * col.stddev)))
+            arrays[col.name] = col.encode(c.if_else(pa.array(rng.random(n, dtype=np.float32) > col.mutate_perc), arr, pa.scalar(col.fill_value)))
+        return replace_columns(table, {col.name: arrays[col.name] for col in self.columns if col.name in arrays})
+
+    def mutate_stream(self, source, seed: int = None, batch_size: int = None) -> Iterator[pa.Table]:
+        # AUGMENT CLEANED BATCHES ON THE FLY, ONE GENERATOR FOR THE WHOLE STREAM (USE A DIFFERENT seed PER EPOCH)
+        rng = np.random.default_rng(seed)
+        for batch in iter_batches(source, batch_size=batch_size):
+            yield self.mutate(pa.Table.from_batches([batch]), rng=rng)
 
     def split(self, X: pa.Table, y: pa.array, perc=0.2) -> Tuple[pa.Table, pa.Table]:
         msk = self.random_mask(n=X.num_rows, perc=perc)
         return X.filter(msk), y.filter(msk), X.filter(c.invert(msk)), y.filter(c.invert(msk))
 
+    def write_splits(self, source, path: str, folds: Union[int, Dict[str, float]] = {'train': 0.8, 'validation': 0.1, 'test': 0.1}, label: str = None, key: str = None, stratify: str = None, seed: int = 0, format: str = 'parquet', compression: str = None, batch_size: int = None) -> Dict[str, int]:
+        # ONE PASS: CLEAN EVERY BATCH, ASSIGN FOLDS AND APPEND TO path/split=<fold>/part-0.<format> (READ BACK WITH ds.dataset(path, partitioning='hive'))
+        # k-FOLD WITH folds=k, UNMEASURED COLUMNS ARE MEASURED ON THE FIRST BATCH (USE fit_stream FIRST)
+        if format not in ('parquet', 'arrow'):
+            raise Exception(f"{format} is not a valid format, use parquet or arrow")
+        assigner = FoldAssigner(folds=folds, key=key, stratify=stratify, seed=seed)
+        columns = list(dict.fromkeys(self.names() + [col for col in (label, key, stratify) if col])) # E.G. stratify=label, OR A key THAT IS ALSO A FEATURE
+        writers, sinks, counts = {}, [], {name: 0 for name in assigner.names}
+        try:
+            for batch in iter_batches(source, columns=columns, batch_size=batch_size):
+                table = pa.Table.from_batches([batch])
+                fold = assigner.assign(table)
+                X, y = self.transform(table, label=label, warn_missing=False)
+                out = self.align(X, y if label else None)
+                for i, name in enumerate(assigner.names):
+                    part = out.filter(pa.array(fold == i))
+                    if part.num_rows == 0:
+                        continue
+                    if name not in writers:
+                        os.makedirs(os.path.join(path, f'split={name}'), exist_ok=True)
+                        file = os.path.join(path, f'split={name}', 'part-0.' + format)
+                        if format == 'parquet':
+                            writers[name] = pq.ParquetWriter(file, part.schema, compression=(compression or 'snappy'))
+                        else:
+                            sinks.append(pa.OSFile(file, 'wb'))
+                            writers[name] = pa.ipc.new_file(sinks[-1], part.schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+                    writers[name].write_table(part)
+                    counts[name] += part.num_rows
+        finally:
+            [writer.close() for writer in writers.values()]
+            [sink.close() for sink in sinks]
+        return counts
+
+    def decode(self, table: pa.Table) -> pa.Table:
+        # BACK TO THE DEFAULT LAYOUT (UP TO PRECISION): float32 NUMERICALS, int64 CATEGORICALS AND ONE BOOLEAN COLUMN PER CATEGORY
+        names, arrays = [], []
+        columns = {feat: col for col in self.columns for feat in col.features()}
+        for name, arr in zip(table.column_names, table.columns):
+            col = columns.get(name)
+            if isinstance(col, OneHotColumn) and pa.types.is_dictionary(arr.type):
+                pos = arr.combine_chunks().indices.fill_null(-1).to_numpy(zero_copy_only=False)
+                names.extend(col.name + '_' + cat for cat in col.categories)
+                arrays.extend(onehot_bitmaps(pos, len(col.categories)))
+            elif isinstance(col, NumericalColumn) and col.policy.floats is not None:
+                names.append(name)
+                arrays.append(col.decode(arr))
+            elif isinstance(col, CategoricalColumn) and col.policy.integers != 'int64':
+                names.append(name)
+                arrays.append(arr.cast(pa.int64()))
+            else:
+                names.append(name)
+                arrays.append(arr)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def footprint(self, table: pa.Table) -> pa.Table:
+        # MEMORY PER FEATURE (BUFFERS OF THE VISIBLE ROWS, DICTIONARIES INCLUDED), LARGEST FIRST
+        nbytes = [arr.nbytes for arr in table.columns]
+        return pa.table({
+            'feature': table.column_names,
+            'type': [str(arr.type) for arr in table.columns],
+            'bytes': pa.array(nbytes, pa.int64()),
+            'bytes_per_row': pa.array([n / max(table.num_rows, 1) for n in nbytes], pa.float64()),
+        }).sort_by([('bytes', 'descending')])
+
     def fill_nans(self, table: pa.Table) -> pa.Table:
+        arrays = {}
         for col in self.columns:
-            if isinstance(col, OneHotColumn):
-                continue
-            elif isinstance(col, CategoricalColumn):
-                    arr = table.column(col.name).fill_null(col.fill_value)                    
-            elif isinstance(col, NumericalColumn):
-                arr = table.column(col.name).fill_null(col.fill_value)
-            table = table.drop([col.name]).append_column(col.name, arr)        
-        return table
+            if isinstance(col, (CategoricalColumn, NumericalColumn)):
+                arrays[col.name] = arrays.get(col.name, table.column(col.name)).fill_null(col.fill_value)
+        return replace_columns(table, arrays)
 
     def align(self, X: pa.Table, y: pa.array = None) -> pa.Table:
         if y: 
@@ -205,10 +720,61 @@ class ThorTableCleaner():
         options = csv.WriteOptions(include_header=False)
         csv.write_csv(table, path, options)
 
+    # BINARY EXPORTS FOR TRAINING
+    def to_numpy(self, table: pa.Table, dtype=np.float32, order: str = 'C', out: np.ndarray = None) -> np.ndarray:
+        # 2D FEATURE MATRIX (NULLS BECOME NAN), order='F' MAKES EVERY COLUMN ONE CONTIGUOUS COPY
+        # DICTIONARY ENCODED ONE-HOTS BECOME ONE COLUMN OF CODES (DICTIONARY INDEX + 1, 0 WHEN NOTHING IS HOT), USE decode FIRST FOR ONE COLUMN PER CATEGORY
+        out = (out if out is not None else np.empty((table.num_rows, table.num_columns), dtype=dtype, order=order))
+        for j, col in enumerate(table.columns):
+            out[:, j] = feature_codes(col).cast(pa.float64() if np.dtype(out.dtype).itemsize > 4 else pa.float32()).fill_null(np.nan).to_numpy()
+        return out
+
+    def iter_numpy(self, table: pa.Table, chunk_size: int = 65536, dtype=np.float32, order: str = 'C') -> Iterator[np.ndarray]:
+        # REUSES ONE PREALLOCATED BUFFER, COPY A CHUNK IF YOU NEED TO KEEP IT (DICTIONARY ENCODED ONE-HOTS AS CODES, SEE to_numpy)
+        buf = np.empty((min(chunk_size, table.num_rows), table.num_columns), dtype=dtype, order=order)
+        for offset in range(0, table.num_rows, chunk_size):
+            chunk = table.slice(offset, chunk_size)
+            yield self.to_numpy(chunk, out=buf[:chunk.num_rows])
+
+    def write_to_npy(self, table: pa.Table, path: str, dtype=np.float32, chunk_size: int = 65536):
+        # WRITE CHUNK BY CHUNK INTO A MEMORY MAPPED .npy, LOAD WITH np.load(path, mmap_mode='r') (DICTIONARY ENCODED ONE-HOTS AS CODES, SEE to_numpy)
+        mat = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(table.num_rows, table.num_columns))
+        for offset in range(0, table.num_rows, chunk_size):
+            chunk = table.slice(offset, chunk_size)
+            self.to_numpy(chunk, out=mat[offset:offset + chunk.num_rows])
+        mat.flush()
+
+    def write_to_parquet(self, table: pa.Table, path: str, compression: str = 'snappy'):
+        pq.write_table(table, path, compression=compression)
+
+    def write_to_feather(self, table: pa.Table, path: str, compression: str = 'uncompressed'):
+        feather.write_feather(table, path, compression=compression)
+
+    def write_to_libsvm(self, table: pa.Table, path: str, label: str = 'label', chunk_size: int = 65536):
+        # SPARSE "label index:value" LINES (ZERO BASED INDICES, AS READ BY LIGHTGBM / XGBOOST), ZEROS AND NULLS ARE SKIPPED
+        # DICTIONARY ENCODED ONE-HOTS ARE WRITTEN AS CODES LIKE IN to_numpy, USE decode FIRST FOR ONE FEATURE PER CATEGORY
+        if label in table.column_names and table.column(label).null_count: # A LINE MUST START WITH ITS LABEL
+            raise Exception(f"{label} contains {table.column(label).null_count} null labels, fill or filter them before writing libsvm")
+        features = [col for col in table.column_names if col != label]
+        prefixes = [pa.scalar(f'{j}:') for j in range(len(features))]
+        sep, newline = pa.scalar(' '), pa.scalar('\n')
+        with open(path, 'wb') as f:
+            for offset in range(0, table.num_rows, chunk_size):
+                chunk = table.slice(offset, chunk_size)
+                labels = (chunk.column(label).cast(pa.float64()).cast(pa.string()) if label in chunk.column_names else pa.repeat(pa.scalar('0'), chunk.num_rows))
+                cells = []
+                for prefix, col in zip(prefixes, features):
+                    arr = feature_codes(chunk.column(col)).cast(pa.float32())
+                    cells.append(c.if_else(c.not_equal(arr, 0), c.binary_join_element_wise(prefix, arr.cast(pa.string()), ''), None))
+                lines = c.binary_join_element_wise(c.binary_join_element_wise(labels, *cells, sep, null_handling='skip'), newline, '')
+                for arr in lines.chunks:
+                    f.write(string_buffer(arr))
+
     # SERIALIZATION
     def to_dict(self):
         return {
-            'columns': [column.to_dict() for column in self.columns]
+            'columns': [column.to_dict() for column in self.columns],
+            'policy': self.policy.to_dict(),
         }
 
     def to_json(self, path):
@@ -217,7 +783,7 @@ class ThorTableCleaner():
 
     @classmethod
     def from_dict(cls, state):
-        cln = ThorTableCleaner()
+        cln = ThorTableCleaner(policy=(DtypePolicy.from_dict(state['policy']) if state.get('policy') else None))
         ctypes = {
             "numerical": NumericalColumn,
             "categorical": CategoricalColumn,
@@ -225,7 +791,7 @@ class ThorTableCleaner():
         }
         for column in state['columns']:
             t = column.pop('type')
-            cln.columns.append(ctypes[t](**column))
+            cln.add(ctypes[t](**column))
         return cln
 
     @classmethod
@@ -234,6 +800,32 @@ class ThorTableCleaner():
             state = json.load(f)
         return cls.from_dict(state)
 
+    # BINARY SERIALIZATION (VOCABULARIES AS ARROW / NPY FILES, MEMORY MAPPED ON LOAD AND ONLY TURNED INTO LISTS WHEN NEEDED)
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        columns = []
+        for i, column in enumerate(self.columns):
+            state = column.to_dict()
+            if state['type'] != 'numerical' and column.size():
+                column.vocab().save(os.path.join(path, f'vocabulary_{i}'))
+                state['categories'], state['vocabulary'] = [], f'vocabulary_{i}'
+            columns.append(state)
+
+        # WRITE THE CONFIG LAST, SO READERS NEVER SEE HALF WRITTEN VOCABULARIES
+        with open(os.path.join(path, 'cleaner.json.tmp'), 'w') as f:
+            json.dump({'columns': columns, 'policy': self.policy.to_dict()}, f)
+        os.replace(os.path.join(path, 'cleaner.json.tmp'), os.path.join(path, 'cleaner.json'))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ThorTableCleaner':
+        with open(os.path.join(path, 'cleaner.json'), 'r') as f:
+            state = json.load(f)
+        vocabularies = {i: column.pop('vocabulary') for i, column in enumerate(state['columns']) if 'vocabulary' in column}
+        cln = cls.from_dict(state)
+        for i, prefix in vocabularies.items():
+            cln.columns[i].set_vocabulary(Vocabulary.load(os.path.join(path, prefix), mmap=mmap))
+        return cln
+
 
     
     
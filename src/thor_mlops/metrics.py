@@ -0,0 +1,77 @@
+import time
+import pyarrow as pa
+from typing import Callable, List
+
+# Per stage instrumentation (wall time, rows in/out, Arrow allocations) for enrich / transform
+class Stage():
+    __slots__ = ('metrics', 'stage', 'name', 'rows_in', 'rows_out', 'start', 'allocated', 'net')
+
+    def __init__(self, metrics: 'ThorMetrics', stage: str, name: str, rows_in: int):
+        self.metrics, self.stage, self.name, self.rows_in, self.rows_out = metrics, stage, name, rows_in, None
+
+    def __enter__(self) -> 'Stage':
+        pool = self.metrics.pool
+        self.allocated, self.net = pool.total_bytes_allocated(), pool.bytes_allocated()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds, pool = time.perf_counter() - self.start, self.metrics.pool
+        rows_out = (self.rows_out if self.rows_out is not None else self.rows_in)
+        self.metrics.record({
+            'stage': self.stage,
+            'name': self.name,
+            'seconds': seconds,
+            'rows_in': self.rows_in,
+            'rows_out': rows_out,
+            'fan_out': (rows_out / self.rows_in if self.rows_in else None),
+            'bytes_allocated': pool.total_bytes_allocated() - self.allocated, # GROSS, INCLUDING TEMPORARIES
+            'bytes_retained': pool.bytes_allocated() - self.net,
+        })
+        return False
+
+class ThorMetrics():
+    enabled = True
+
+    def __init__(self, callbacks: List[Callable[[dict], None]] = [], pool: pa.MemoryPool = None):
+        # MEASURES THE WHOLE POOL, SO CONCURRENT WORK IN OTHER THREADS IS COUNTED AS WELL
+        self.records, self.callbacks, self.pool = [], list(callbacks), (pool or pa.default_memory_pool())
+
+    def stage(self, stage: str, name: str = None, rows_in: int = None) -> Stage:
+        return Stage(self, stage, name, rows_in)
+
+    def record(self, record: dict):
+        self.records.append(record)
+        for callback in self.callbacks:
+            callback(record)
+
+    def clear(self):
+        self.records = []
+
+    # EXPORT
+    def to_dicts(self) -> List[dict]:
+        return list(self.records)
+
+    def to_table(self) -> pa.Table:
+        return pa.Table.from_pylist(self.records, schema=pa.schema([('stage', pa.string()), ('name', pa.string()), ('seconds', pa.float64()), ('rows_in', pa.int64()), ('rows_out', pa.int64()), ('fan_out', pa.float64()), ('bytes_allocated', pa.int64()), ('bytes_retained', pa.int64())]))
+
+    def summary(self) -> pa.Table:
+        # TOTALS PER STAGE & NAME, SLOWEST FIRST
+        return self.to_table().group_by(['stage', 'name']).aggregate([('seconds', 'sum'), ('seconds', 'count'), ('rows_in', 'sum'), ('rows_out', 'sum'), ('bytes_allocated', 'sum')]).sort_by([('seconds_sum', 'descending')])
+
+class NullStage():
+    def __enter__(self) -> 'NullStage':
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullMetrics(ThorMetrics):
+    # DISABLED METRICS, stage() RETURNS ONE SHARED NO-OP CONTEXT MANAGER
+    enabled = False
+    null_stage = NullStage()
+
+    def stage(self, stage: str, name: str = None, rows_in: int = None) -> NullStage:
+        return self.null_stage
+
+NULL_METRICS = NullMetrics()
@@ -1,16 +1,74 @@
+import os
+import hashlib
 import pyarrow as pa
+import pyarrow.compute as c
+import pyarrow.dataset as ds
+import pyarrow.json as pj
 import orjson as json
 import numpy as np
+from typing import Iterator, List, Tuple, Union
 
-def loads_json_column(table: pa.Table, column:str, drop:bool = False) -> pa.Table:
-    arr = np.vectorize(json.loads)(table.column(column).to_numpy())
-    arr[arr == None] = dict()
-    keys = set.union(*np.vectorize(lambda x: set(x.keys()))(arr[:min(arr.shape[0], 1000)])) # Gather keys from first 1000 samples
-    arr[0] = {**{k:None for k in keys}, **arr[0]} # Pyarrow uses first dict as columns, so update that one with keys
-    jt = pa.Table.from_pylist(arr.tolist()) #.cast(pa.schema([(k, pa.string()) for k in keys]))
-    for pc in jt.column_names:
-        table = table.append_column(column + '/' + pc, jt.column(pc))
-    return (table.drop([column]) if drop else table)
+def string_buffer(arr: pa.array) -> pa.Buffer:
+    # ALL VALUES OF A (LARGE) STRING ARRAY AS ONE CONTIGUOUS BUFFER, WITHOUT COPYING
+    width = (np.int64 if pa.types.is_large_string(arr.type) else np.int32)
+    offsets = np.frombuffer(arr.buffers()[1], dtype=width)[arr.offset:arr.offset + len(arr) + 1]
+    return arr.buffers()[2].slice(int(offsets[0]), int(offsets[-1] - offsets[0]))
+
+def read_json_column(arr: pa.array, schema: pa.Schema = None) -> pa.Table:
+    # PARSE ALL VALUES AT ONCE WITH ARROW'S JSON READER OVER ONE NEWLINE DELIMITED BUFFER
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr).cast(pa.large_string()).fill_null('{}')
+    if len(arr) == 0 or c.any(c.match_substring(arr, '\n')).as_py():
+        raise pa.ArrowInvalid("Cannot read JSON column as newline delimited JSON")
+    buf = string_buffer(c.binary_join_element_wise(arr, pa.scalar('\n', pa.large_string()), pa.scalar('', pa.large_string())))
+    read_options = pj.ReadOptions(block_size=max(1 << 20, 2 * c.max(c.binary_length(arr)).as_py() + 2))
+
+    def read(explicit_schema: pa.Schema = None, unexpected: str = 'infer') -> pa.Table:
+        return pj.read_json(pa.BufferReader(buf), read_options=read_options, parse_options=pj.ParseOptions(explicit_schema=explicit_schema, unexpected_field_behavior=unexpected))
+
+    jt = (read(schema, 'ignore') if schema is not None else read())
+    if schema is None and any(pa.types.is_timestamp(f.type) for f in jt.schema): # KEEP DATE-LIKE STRINGS AS STRINGS
+        jt = read(pa.schema([(f.name, pa.string()) for f in jt.schema if pa.types.is_timestamp(f.type)]))
+    if jt.num_rows != len(arr):
+        raise pa.ArrowInvalid("JSON column contains empty or multiple documents per value")
+    return jt
+
+def loads_json_python(arr: pa.array, schema: pa.Schema = None) -> pa.Table:
+    arr = np.vectorize(json.loads, otypes=[object])(arr.fill_null('{}').to_numpy(zero_copy_only=False))
+    arr[arr == None] = dict() # JSON null BECOMES AN EMPTY DOCUMENT
+    if schema is None and len(arr): # GATHER KEYS FROM ALL ROWS, PYARROW USES THE FIRST DICT AS COLUMNS
+        keys = list(dict.fromkeys(k for d in arr for k in d))
+        arr[0] = {**{k: None for k in keys}, **arr[0]}
+    return pa.Table.from_pylist(arr.tolist(), schema=schema)
+
+def loads_json_column(table: pa.Table, column:str, drop:bool = False, schema: pa.Schema = None) -> pa.Table:
+    try:
+        jt = read_json_column(table.column(column), schema=schema)
+    except pa.ArrowInvalid: # MULTI-LINE DOCUMENTS, CONFLICTING TYPES ACROSS BLOCKS, ...
+        jt = loads_json_python(table.column(column).combine_chunks(), schema=schema)
+    names = [col for col in table.column_names if not (drop and col == column)]
+    return pa.Table.from_arrays([table.column(col) for col in names] + jt.columns, names=names + [column + '/' + col for col in jt.column_names])
+
+# Replace columns in one pass (replaced columns move to the end, like drop + append_column)
+def replace_columns(table: pa.Table, arrays: dict) -> pa.Table:
+    names = [col for col in table.column_names if col not in arrays]
+    return pa.Table.from_arrays([table.column(col) for col in names] + list(arrays.values()), names=names + list(arrays.keys()))
+
+# Iterate over record batches of a table, dataset, reader or iterable of batches/tables
+def iter_batches(source, columns: List[str] = None, batch_size: int = None) -> Iterator[pa.RecordBatch]:
+    if isinstance(source, ds.Dataset): # ONLY SCAN THE COLUMNS WE NEED
+        kwargs = {'batch_size': batch_size} if batch_size else {}
+        cols = ([col for col in columns if col in source.schema.names] if columns is not None else None)
+        yield from source.to_batches(columns=cols, **kwargs)
+    elif isinstance(source, pa.Table):
+        yield from source.to_batches(max_chunksize=batch_size)
+    elif isinstance(source, pa.RecordBatch):
+        yield source
+    else: # RecordBatchReader or any iterable of RecordBatches / Tables
+        for batch in source:
+            if isinstance(batch, pa.Table):
+                yield from batch.to_batches(max_chunksize=batch_size)
+            else:
+                yield batch
 
 # Show for easier printing
 def head(table, n=5, max_width=100):
@@ -31,4 +89,246 @@ def head(table, n=5, max_width=100):
     for i in range(len(data)):
         adjust = [w.ljust(max(cw, dw) + 2) for w, cw, dw in zip(data[i], col_width, data_width)]
         print(('Row  ' if i == 0 else str(i-1).ljust(5)) + "".join(adjust)[:max_width])
-    print('\n')
\ No newline at end of file
+    print('\n')
+
+# Persistent key -> row position index (vectorized lookups without rebuilding a hash table per join)
+def key_values(arr) -> Tuple[np.ndarray, np.ndarray]:
+    # VALUES (NULLS FILLED) AND VALIDITY, INTEGERS STAY INTEGERS (NOT FLOAT64 WITH NaN) AND STRINGS BECOME PYTHON OBJECTS (NOT PADDED TO THE LONGEST KEY)
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr)
+    if pa.types.is_dictionary(arr.type): arr = arr.cast(arr.type.value_type)
+    valid = arr.is_valid().to_numpy(zero_copy_only=False)
+    if arr.null_count and (pa.types.is_integer(arr.type) or pa.types.is_boolean(arr.type) or pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)):
+        arr = arr.fill_null(False if pa.types.is_boolean(arr.type) else ('' if not pa.types.is_integer(arr.type) else 0))
+    return arr.to_numpy(zero_copy_only=False), valid
+
+def sorted_search(arr: np.ndarray, vals: np.ndarray) -> np.ndarray:
+    # SEARCHING SORTED NEEDLES IS CACHE FRIENDLY, WHICH MORE THAN PAYS FOR THE ARGSORT
+    order = np.argsort(vals)
+    pos = np.empty(len(vals), dtype=np.int64)
+    pos[order] = np.searchsorted(arr, vals[order])
+    return np.minimum(pos, max(len(arr) - 1, 0))
+
+BISECT_RATIO = 128 # index_in HASHES ALL VALUES PER CALL (~0.2us EACH), A BINARY SEARCH (~30us PER KEY) IS CHEAPER WHILE THERE ARE FEWER KEYS THAN len(values) / BISECT_RATIO
+
+def string_search(values: pa.array, keys: List[bytes], order: np.ndarray = None) -> np.ndarray:
+    # POSITION OF EVERY KEY (-1 IF UNKNOWN OR None) IN THE BYTE SORTED (THROUGH order) STRING / BINARY values, SEARCHING THEIR OFFSETS & BYTES IN PLACE
+    buffers, n = values.buffers(), (len(order) if order is not None else len(values))
+    offsets = np.frombuffer(buffers[1], dtype=np.int32)[values.offset:values.offset + len(values) + 1]
+    data = (np.frombuffer(buffers[2], dtype=np.uint8) if buffers[2] is not None else np.zeros(0, dtype=np.uint8))
+    at = ((lambda i: int(order[i])) if order is not None else (lambda i: i))
+    value = lambda i: data[offsets[at(i)]:offsets[at(i) + 1]].tobytes()
+    pos = np.full(len(keys), -1, dtype=np.int64)
+    for j, key in enumerate(keys):
+        if key is None:
+            continue
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < n and value(lo) == key:
+            pos[j] = at(lo)
+    return pos
+
+def sorted_uniques(arr) -> Tuple[np.ndarray, np.ndarray]:
+    # SORTED DISTINCT VALUES OF A COLUMN WITHOUT NULLS AND THE POSITION OF EVERY VALUE AMONG THEM (SORTING EVERY DISTINCT VALUE ONCE)
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr)
+    arr = (arr.cast(arr.type.value_type) if pa.types.is_dictionary(arr.type) else arr).dictionary_encode()
+    u, inverse = np.unique(key_values(arr.dictionary)[0], return_inverse=True)
+    return u, inverse.astype(np.int64)[arr.indices.to_numpy(zero_copy_only=False)]
+
+def arrow_key_positions(u: pa.array, arr: pa.array) -> Tuple[np.ndarray, np.ndarray]:
+    # key_positions FOR SORTED (MEMORY MAPPED) ARROW STRING UNIQUES: A BINARY SEARCH PER DISTINCT VALUE FOR SMALL INPUTS, index_in FOR BULK INPUTS (NO PYTHON COPY OF u)
+    if not any(f(arr.type.value_type if pa.types.is_dictionary(arr.type) else arr.type) for f in (pa.types.is_string, pa.types.is_large_string, pa.types.is_binary, pa.types.is_large_binary)):
+        return np.zeros(len(arr), dtype=np.int64), np.zeros(len(arr), dtype=bool) # STRING KEYS NEVER MATCH NUMERICAL KEYS
+    arr = (arr if pa.types.is_dictionary(arr.type) else arr.dictionary_encode())
+    keys = arr.dictionary.cast(pa.binary())
+    if len(keys) * BISECT_RATIO <= len(u):
+        dmap = string_search(u, keys.to_pylist())
+    else:
+        dmap = c.index_in(keys, value_set=u.view(pa.binary())).fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+    idx = arr.indices.fill_null(len(keys)).to_numpy(zero_copy_only=False) # NULL INDICES POINT PAST THE DICTIONARY, WHICH IS NEVER FOUND
+    dmap = np.append(dmap, -1)[idx]
+    return np.maximum(dmap, 0), dmap >= 0
+
+def key_positions(u: np.ndarray, arr) -> Tuple[np.ndarray, np.ndarray]:
+    # POSITION OF EVERY VALUE IN THE SORTED UNIQUES u AND WHETHER IT IS THERE (NULLS NEVER ARE), STRINGS ARE SEARCHED ONCE PER DISTINCT VALUE
+    arr, indices = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr), None
+    if isinstance(u, pa.Array):
+        return arrow_key_positions(u, arr)
+    if pa.types.is_dictionary(arr.type) or ((pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type) or pa.types.is_binary(arr.type)) and len(arr) > 1):
+        arr = (arr if pa.types.is_dictionary(arr.type) else arr.dictionary_encode())
+        indices, arr = arr.indices, arr.dictionary
+    vals, valid = key_values(arr)
+    if (u.dtype == object) != (vals.dtype == object): # STRING KEYS NEVER MATCH NUMERICAL KEYS
+        pos, found = np.zeros(len(vals), dtype=np.int64), np.zeros(len(vals), dtype=bool)
+    else:
+        pos = sorted_search(u, vals)
+        found = valid & ((u[pos] == vals) if len(u) else False)
+    if indices is not None: # NULL INDICES POINT PAST THE DICTIONARY, WHICH IS NEVER FOUND
+        idx = indices.fill_null(len(vals)).to_numpy(zero_copy_only=False)
+        pos, found = np.append(pos, 0)[idx], np.append(found, False)[idx]
+    return pos, found
+
+class TableIndex():
+    def __init__(self, table: pa.Table, keys: List[str]):
+        self.keys, self.num_rows = keys, table.num_rows
+        valid = np.logical_and.reduce([table.column(k).is_valid().to_numpy(zero_copy_only=False) for k in keys]) # NULL KEYS NEVER MATCH IN A JOIN
+        rows = np.nonzero(valid)[0]
+
+        # ENCODE (COMPOSITE) KEYS AS ONE INT64 CODE USING THE SORTED UNIQUE VALUES OF EVERY KEY COLUMN
+        columns = [sorted_uniques(table.column(k).filter(pa.array(valid))) for k in keys]
+        self.uniques = [u for u, _ in columns]
+        self.strides = np.cumprod([1] + [max(len(u), 1) for u in self.uniques[:0:-1]])[::-1].tolist()
+        self.usable = float(np.prod([max(len(u), 1) for u in self.uniques], dtype=np.float64)) < 2 ** 62
+        codes = sum(pos * s for (_, pos), s in zip(columns, self.strides)) if self.usable else np.zeros(0, np.int64)
+
+        order = np.argsort(codes, kind='stable')
+        self.codes, self.positions = codes[order], rows[order]
+        self.unique = bool(self.usable and not np.any(self.codes[1:] == self.codes[:-1])) # DUPLICATE KEYS FAN OUT, WHICH NEEDS A REAL JOIN
+        self.dense = bool(self.unique and len(self.codes) and self.codes[-1] == len(self.codes) - 1) # CODE IS THE POSITION IN self.codes (E.G. SINGLE UNIQUE KEY)
+        self.changed_keys, self.changed_positions, self.overlay = None, None, None
+
+    # SERIALIZATION (NPY FILES CAN BE MEMORY MAPPED)
+    def to_dict(self) -> dict:
+        return {'keys': self.keys, 'num_rows': self.num_rows, 'strides': self.strides, 'usable': self.usable, 'unique': self.unique, 'dense': self.dense}
+
+    def save(self, prefix: str) -> dict:
+        if self.overlay is not None:
+            raise Exception("Index has pending changes, rebuild it before saving")
+        np.save(prefix + '.codes.npy', self.codes)
+        np.save(prefix + '.positions.npy', self.positions)
+        for i, u in enumerate(self.uniques):
+            if u.dtype == object: # STRING KEYS AS ARROW (NUMPY WOULD PICKLE THEM)
+                uniques = pa.table({'uniques': pa.array(u, (pa.binary() if len(u) and isinstance(u[0], bytes) else pa.string()))})
+                with pa.OSFile(prefix + f'.uniques_{i}.arrow', 'wb') as sink, pa.ipc.new_file(sink, uniques.schema) as writer:
+                    writer.write_table(uniques)
+            else:
+                np.save(prefix + f'.uniques_{i}.npy', u)
+        return self.to_dict()
+
+    @classmethod
+    def load(cls, prefix: str, state: dict, mmap: bool = True) -> 'TableIndex':
+        idx, mode = cls.__new__(cls), ('r' if mmap else None)
+        idx.keys, idx.num_rows, idx.strides, idx.usable, idx.unique, idx.dense = state['keys'], state['num_rows'], state['strides'], state['usable'], state['unique'], state['dense']
+        idx.codes, idx.positions = np.load(prefix + '.codes.npy', mmap_mode=mode), np.load(prefix + '.positions.npy', mmap_mode=mode)
+        idx.uniques = [(pa.ipc.open_file(pa.memory_map(prefix + f'.uniques_{i}.arrow', 'r')).read_all().column('uniques').combine_chunks() if os.path.exists(prefix + f'.uniques_{i}.arrow') else np.load(prefix + f'.uniques_{i}.npy', mmap_mode=mode)) for i in range(len(idx.keys))]
+        idx.changed_keys, idx.changed_positions, idx.overlay = None, None, None
+        return idx
+
+    def search(self, table: pa.Table) -> np.ndarray:
+        # ROW POSITION IN THE INDEXED TABLE FOR EVERY ROW OF table, -1 WHEN THERE IS NO MATCH (IGNORING CHANGES)
+        found, codes = np.ones(table.num_rows, dtype=bool), np.zeros(table.num_rows, dtype=np.int64)
+        for i, (k, s) in enumerate(zip(self.keys, self.strides)):
+            pos, hit = key_positions(self.key_uniques(i), table.column(k))
+            found &= hit
+            codes += pos * s
+        p = (np.minimum(codes, len(self.codes) - 1) if self.dense else sorted_search(self.codes, codes)) # COMPOSITE CODES CAN POINT PAST THE END, THE CHECK BELOW REJECTS THEM
+        found &= (self.codes[p] == codes) if len(self.codes) else False
+        return np.where(found, (self.positions[p] if len(self.positions) else -1), -1)
+
+    def key_uniques(self, i: int) -> Union[np.ndarray, pa.Array]:
+        # LOADED STRING KEYS STAY (MEMORY MAPPED) ARROW ARRAYS, FIXED WIDTH STRINGS OF OLDER SAVES BECOME PYTHON OBJECTS ON FIRST USE
+        u = self.uniques[i]
+        if not isinstance(u, pa.Array) and u.dtype.kind == 'U':
+            u = self.uniques[i] = u.astype(object)
+        return u
+
+    def lookup(self, table: pa.Table) -> np.ndarray:
+        # ROW POSITION IN THE INDEXED TABLE FOR EVERY ROW OF table, -1 WHEN THERE IS NO MATCH
+        pos = self.search(table)
+        if self.overlay is not None: # CHANGED KEYS TAKE PRECEDENCE (POSITION -1 FOR DELETED KEYS)
+            p = self.overlay.search(table)
+            hit = p >= 0
+            pos[hit] = self.changed_positions[p[hit]]
+        return pos
+
+    # INCREMENTAL CHANGES (ONLY FOR UNIQUE INDEXES)
+    def upsert(self, keys: pa.Table, positions: np.ndarray):
+        # POINT keys TO NEW ROW POSITIONS (-1 TO DELETE) IN A SMALL OVERLAY INDEX, THE MAIN ARRAYS ARE NEVER REWRITTEN (AND CAN STAY MEMORY MAPPED)
+        keys = keys.select(self.keys)
+        if self.overlay is not None: # LAST WRITE WINS
+            p = self.overlay.search(keys)
+            keep = np.ones(len(self.changed_positions), dtype=bool)
+            keep[p[p >= 0]] = False
+            keys = pa.concat_tables([self.changed_keys.filter(pa.array(keep)), keys.cast(self.changed_keys.schema)])
+            positions = np.concatenate([self.changed_positions[keep], positions])
+        self.changed_keys, self.changed_positions = keys, np.asarray(positions, dtype=np.int64)
+        self.overlay = TableIndex(table=keys, keys=self.keys)
+
+    def pending(self) -> int:
+        return (len(self.changed_positions) if self.overlay is not None else 0)
+
+    def live(self, n: int) -> np.ndarray:
+        # MASK OF THE n ROWS OF THE INDEXED TABLE (INCLUDING APPENDED ROWS) THAT ARE NOT REPLACED OR DELETED
+        mask = np.zeros(n, dtype=bool)
+        mask[:self.num_rows] = True
+        if self.overlay is not None:
+            old = self.search(self.changed_keys)
+            mask[old[old >= 0]] = False
+            mask[self.changed_positions[self.changed_positions >= 0]] = True
+        return mask
+
+def values_digest(arr: pa.array) -> str:
+    # SHA-256 OF THE LENGTHS, BYTES AND NULLS OF A STRING ARRAY, WITHOUT TURNING IT INTO PYTHON STRINGS
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr).cast(pa.string())
+    h = hashlib.sha256()
+    if len(arr):
+        offsets = np.frombuffer(arr.buffers()[1], dtype=np.int32)[arr.offset:arr.offset + len(arr) + 1]
+        h.update(np.diff(offsets).astype(np.int64).tobytes())
+        h.update(string_buffer(arr))
+        if arr.null_count: h.update(np.packbits(arr.is_valid().to_numpy(zero_copy_only=False)).tobytes())
+    return h.hexdigest()
+
+# Category -> position lookups: binary search over the sorted Arrow values for small inputs, index_in for bulk inputs (can be memory mapped)
+class Vocabulary():
+    def __init__(self, values: pa.array, order: np.ndarray = None):
+        self.values = (values.combine_chunks() if isinstance(values, pa.ChunkedArray) else values).cast(pa.string())
+        self.order = order
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def sorted_order(self) -> np.ndarray:
+        # POSITIONS OF THE VALUES IN BYTE ORDER (NULLS LEFT OUT), STABLE SO THE FIRST OCCURRENCE WINS FOR DUPLICATES LIKE index_in, BUILT ONCE
+        if self.order is None:
+            self.order = c.sort_indices(self.values).to_numpy()[:len(self.values) - self.values.null_count]
+        return self.order
+
+    def search(self, arr: pa.array) -> Tuple[np.ndarray, pa.array]:
+        # POSITION OF EVERY DICTIONARY VALUE OF arr (-1 IF UNKNOWN) AND THE DICTIONARY INDICES
+        arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr).cast(pa.string()).dictionary_encode()
+        if len(self.values) == 0 or len(arr.dictionary) == 0:
+            return np.full(len(arr.dictionary), -1, dtype=np.int64), arr.indices
+        if len(arr.dictionary) * BISECT_RATIO <= len(self.values):
+            return string_search(self.values, arr.dictionary.cast(pa.binary()).to_pylist(), order=self.sorted_order()), arr.indices
+        dmap = c.index_in(arr.dictionary, value_set=self.values).fill_null(-1)
+        return dmap.to_numpy(zero_copy_only=False).astype(np.int64, copy=False), arr.indices
+
+    def positions(self, arr: pa.array) -> Tuple[pa.array, pa.array]:
+        dmap, indices = self.search(arr)
+        return pa.array(dmap), indices
+
+    def codes(self, arr: pa.array, type: pa.DataType = pa.int64()) -> pa.array:
+        # POSITION + 1 (0 FOR UNKNOWN, NULL FOR NULL) AS int64, LIKE clean_categorical
+        dmap, indices = self.search(arr)
+        return c.take(pa.array((dmap + 1).astype(type.to_pandas_dtype(), copy=False)), indices)
+
+    def dictionary(self, arr: pa.array, index_type: pa.DataType = pa.int32()) -> pa.DictionaryArray:
+        # DICTIONARY ENCODED OVER THE VALUES (NULL FOR UNKNOWN AND NULL)
+        dmap, indices = self.search(arr)
+        return pa.DictionaryArray.from_arrays(c.take(pa.array(dmap.astype(index_type.to_pandas_dtype(), copy=False), mask=(dmap < 0)), indices), self.values)
+
+    def save(self, prefix: str):
+        # THE SORTED ORDER IS SAVED TOO, SO A LOADED VOCABULARY NEVER SORTS
+        with pa.OSFile(prefix + '.values.arrow', 'wb') as sink, pa.ipc.new_file(sink, pa.schema([('values', pa.string())])) as writer:
+            writer.write_table(pa.table({'values': self.values}))
+        np.save(prefix + '.sort.npy', self.sorted_order())
+
+    @classmethod
+    def load(cls, prefix: str, mmap: bool = True) -> 'Vocabulary':
+        source = (pa.memory_map(prefix + '.values.arrow', 'r') if mmap else pa.OSFile(prefix + '.values.arrow', 'rb'))
+        order = (np.load(prefix + '.sort.npy', mmap_mode=('r' if mmap else None)) if os.path.exists(prefix + '.sort.npy') else None) # SORTED LAZILY FOR OLDER SAVES
+        return cls(pa.ipc.open_file(source).read_all().column('values'), order=order)
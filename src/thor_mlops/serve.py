@@ -0,0 +1,160 @@
+import asyncio
+import numpy as np
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.metrics import ThorMetrics, NULL_METRICS
+
+# Micro-batching front end: concurrent (single row) requests are coalesced into one base table, enriched once and scattered back
+class ThorBatcher():
+    REQUEST = '$request'
+
+    def __init__(self, sts: ThorStarSchema, max_batch: int = 256, max_latency: float = 0.002, max_pending: int = 4096, workers: int = 1, features: List[str] = None, schema: pa.Schema = None, compiled: bool = True, metrics: ThorMetrics = NULL_METRICS):
+        # max_batch: MAX BASE ROWS PER ENRICH, max_latency: SECONDS THE FIRST REQUEST OF A BATCH WAITS FOR OTHERS
+        # max_pending: QUEUED REQUESTS BEFORE enrich() WAITS (BACKPRESSURE), workers: BATCHES ENRICHED CONCURRENTLY (IN THREADS, ARROW RELEASES THE GIL)
+        # schema: TYPES OF THE BASE COLUMNS FOR dict REQUESTS (INFERRED OTHERWISE)
+        self.sts, self.features, self.schema, self.metrics = sts, features, schema, metrics
+        self.max_batch, self.max_latency, self.max_pending, self.workers = max_batch, max_latency, max_pending, workers
+        self.plan = (sts.compile(features=features) if compiled else None)
+        self.queue, self.tasks, self.executor, self.closed = None, [], None, False
+        self.batches, self.requests = 0, 0
+
+    # LIFECYCLE (INSIDE A RUNNING EVENT LOOP)
+    def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.tasks = [asyncio.get_running_loop().create_task(self.worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        # STOP ACCEPTING REQUESTS, FINISH THE QUEUED ONES
+        self.closed = True
+        if not self.tasks:
+            return
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+        self.tasks = []
+
+    async def __aenter__(self) -> 'ThorBatcher':
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    # REQUESTS
+    async def enrich(self, request: Union[dict, pa.Table]) -> Tuple[pa.Table, pa.Table, pa.array, pa.array]:
+        # SAME OUTPUT AS ThorStarSchema.enrich FOR THE ROW(S) OF THIS REQUEST, WAITS WHEN max_pending REQUESTS ARE QUEUED
+        if self.closed:
+            raise Exception("ThorBatcher is closed")
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    def pending(self) -> int:
+        return (self.queue.qsize() if self.queue is not None else 0)
+
+    # BATCHING
+    async def collect(self) -> list:
+        # WAIT FOR ONE REQUEST, THEN TAKE MORE UNTIL max_batch ROWS OR max_latency AFTER THE FIRST ONE
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline, rows = loop.time() + self.max_latency, self.rows(batch[0][0])
+        while rows < self.max_batch:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            rows += self.rows(item[0])
+        return batch
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect()
+            try:
+                live = [(request, future) for request, future in batch if not future.done()] # SKIP CANCELLED CALLERS
+                if not live:
+                    continue
+                try:
+                    results = await loop.run_in_executor(self.executor, self.run, [request for request, _ in live])
+                    self.batches, self.requests = self.batches + 1, self.requests + len(live) # ON THE EVENT LOOP, NOT IN THE EXECUTOR THREADS
+                except Exception as e: # ONE BAD REQUEST MUST NOT FAIL THE OTHERS, RETRY THEM ONE BY ONE (WITH THE COLUMNS OF THE BATCH)
+                    columns = (self.batch_columns([request for request, _ in live]) if len(live) > 1 else None)
+                    results = ([e] if len(live) == 1 else [await self.retry(request, columns) for request, _ in live])
+                for (_, future), result in zip(live, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception): future.set_exception(result)
+                    else: future.set_result(result)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def retry(self, request: Union[dict, pa.Table], columns: pa.Schema = None) -> Union[Tuple[pa.Table, pa.Table, pa.array, pa.array], Exception]:
+        # ENRICH ONE REQUEST OF A FAILED BATCH ON ITS OWN, ITS EXCEPTION IS RETURNED FOR ITS CALLER ONLY
+        try:
+            result = (await asyncio.get_running_loop().run_in_executor(self.executor, self.run, [request], columns))[0]
+        except Exception as e:
+            return e
+        self.batches, self.requests = self.batches + 1, self.requests + 1
+        return result
+
+    @staticmethod
+    def rows(request: Union[dict, pa.Table]) -> int:
+        return (1 if isinstance(request, dict) else request.num_rows)
+
+    def batch_columns(self, requests: list) -> pa.Schema:
+        # BASE COLUMNS OF A BATCH (None WHEN THE REQUESTS CANNOT BE COMBINED)
+        try:
+            return self.base_table(requests).drop([self.REQUEST]).schema
+        except Exception:
+            return None
+
+    def base_table(self, requests: list, columns: pa.Schema = None) -> pa.Table:
+        # ONE BASE TABLE WITH THE REQUEST NUMBER OF EVERY ROW, dict ROWS ARE CONVERTED IN ONE GO
+        # columns: BASE COLUMNS OF THE BATCH A RETRIED REQUEST CAME FROM, SO IT IS ENRICHED AS IN A BATCH THAT DID NOT FAIL
+        if columns is None and all(isinstance(r, dict) for r in requests):
+            if self.schema is not None:
+                base = pa.Table.from_pylist(requests, schema=self.schema)
+            else: # COLUMNS OF ALL REQUESTS (from_pylist ONLY USES THE KEYS OF THE FIRST DICT), MISSING KEYS BECOME NULL
+                base = pa.Table.from_pydict({k: [r.get(k) for r in requests] for k in dict.fromkeys(k for r in requests for k in r)})
+            return base.append_column(self.REQUEST, pa.array(np.arange(len(requests))))
+        tables = [(pa.Table.from_pylist([r], schema=self.schema) if isinstance(r, dict) else r) for r in requests]
+        schema = pa.unify_schemas([t.schema for t in tables] + ([columns] if columns is not None else [])) # COLUMNS MISSING IN A REQUEST BECOME NULL
+        base = pa.concat_tables([pa.Table.from_arrays([(t.column(f.name) if f.name in t.column_names else pa.nulls(t.num_rows, f.type)) for f in schema], schema=schema) for t in tables])
+        return base.append_column(self.REQUEST, pa.array(np.repeat(np.arange(len(tables)), [t.num_rows for t in tables])))
+
+    def run(self, requests: list, columns: pa.Schema = None) -> List[Tuple[pa.Table, pa.Table, pa.array, pa.array]]:
+        # ONE ENRICH FOR THE WHOLE BATCH, OUTPUT ROWS ARE GROUPED BY REQUEST (JOINS CAN DROP, MULTIPLY AND REORDER ROWS)
+        base = self.base_table(requests, columns)
+        with self.metrics.stage('batch', rows_in=base.num_rows) as stage:
+            if self.plan is not None:
+                context, X, y, w = self.plan.enrich(base, metrics=self.metrics)
+            else:
+                context, X, y, w = self.sts.enrich(base, metrics=self.metrics, features=self.features)
+            stage.rows_out = X.num_rows
+
+        ids = context.column(self.REQUEST).to_numpy()
+        context = context.drop([self.REQUEST])
+        if len(ids) > 1 and np.any(ids[1:] < ids[:-1]):
+            order = pa.array(np.argsort(ids, kind='stable'))
+            ids, context, X = ids[order.to_numpy()], context.take(order), X.take(order)
+            y, w = (y.take(order) if y is not None else None), (w.take(order) if w is not None else None)
+        bounds = np.searchsorted(ids, np.arange(len(requests) + 1)).tolist()
+        return [(context.slice(s, e - s), X.slice(s, e - s), (y.slice(s, e - s) if y is not None else None), (w.slice(s, e - s) if w is not None else None)) for s, e in zip(bounds[:-1], bounds[1:])]
@@ -0,0 +1,188 @@
+import base64
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as c
+from typing import List
+
+# Mergeable sketches for fitting columns on data that does not fit in one pass / process
+
+# Quantiles: merging t-digest (k1 scale function), centroids are merged in vectorized passes
+class QuantileSketch():
+    def __init__(self, compression: float = 400.0, means: List[float] = [], weights: List[float] = [], v_min: float = None, v_max: float = None):
+        self.compression = compression
+        self.means, self.weights = np.asarray(means, dtype=np.float64), np.asarray(weights, dtype=np.float64)
+        self.min, self.max = v_min, v_max
+
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means)
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        if total == 0:
+            self.means, self.weights = means, weights
+            return
+
+        # CENTROIDS STARTING IN THE SAME UNIT OF THE SCALE FUNCTION ARE MERGED (SMALL CENTROIDS IN THE TAILS, LARGE IN THE MIDDLE)
+        q = np.clip((np.cumsum(weights) - weights) / total, 0, 1)
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        starts = np.concatenate([[0], np.nonzero(np.diff(k))[0] + 1])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def update(self, arr: pa.array):
+        vals = c.drop_null(arr).cast(pa.float64()).to_numpy(zero_copy_only=False)
+        vals = vals[~np.isnan(vals)]
+        if len(vals) == 0:
+            return
+        self.min = (float(vals.min()) if self.min is None else min(self.min, float(vals.min())))
+        self.max = (float(vals.max()) if self.max is None else max(self.max, float(vals.max())))
+        self.compress(np.concatenate([self.means, vals]), np.concatenate([self.weights, np.ones(len(vals))]))
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.count() == 0:
+            return
+        self.min = (other.min if self.min is None else min(self.min, other.min))
+        self.max = (other.max if self.max is None else max(self.max, other.max))
+        self.compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+
+    def quantile(self, q: float) -> float:
+        if self.count() == 0:
+            return None
+        # INTERPOLATE BETWEEN CENTROID CENTERS, PINNED TO THE EXACT MIN & MAX
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.count(), np.concatenate([[0], centers, [self.count()]]), np.concatenate([[self.min], self.means, [self.max]])))
+
+    def to_dict(self) -> dict:
+        return {"compression": self.compression, "means": self.means.tolist(), "weights": self.weights.tolist(), "v_min": self.min, "v_max": self.max}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'QuantileSketch':
+        return cls(**state)
+
+# Distinct count: HyperLogLog over a 64 bit hash of the utf-8 values
+def hash_strings(arr: pa.array, seed: int = 0) -> np.ndarray:
+    # DETERMINISTIC ACROSS PROCESSES AND BATCHES (UNLIKE hash()), SO REGISTERS OF DIFFERENT SHARDS CAN BE MERGED
+    # EVERY VALUE ONLY MIXES ITS OWN 8 BYTE WORDS (READ FROM THE ARROW BUFFERS) AND ITS LENGTH, SO "a" AND "a\x00" DIFFER
+    arr = (arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr).cast(pa.large_binary())
+    n = len(arr)
+    offsets = (np.frombuffer(arr.buffers()[1], dtype=np.int64)[arr.offset:arr.offset + n + 1] if n else np.zeros(1, dtype=np.int64))
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    data = arr.buffers()[2] if n else None
+    data = np.concatenate([(np.frombuffer(data, dtype=np.uint8) if data is not None else np.zeros(0, dtype=np.uint8)), np.zeros(8, dtype=np.uint8)])
+    h = np.full(n, 0x9E3779B97F4A7C15 ^ (seed & 0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i in range(0, int(lengths.max()) if n else 0, 8):
+            active = np.nonzero(lengths > i)[0]
+            words = np.ascontiguousarray(data[(starts[active] + i)[:, None] + np.arange(8)]).view('<u8').ravel()
+            left = np.minimum(lengths[active] - i, 8)
+            words &= np.where(left >= 8, np.uint64(0xFFFFFFFFFFFFFFFF), (np.uint64(1) << (8 * np.minimum(left, 7)).astype(np.uint64)) - np.uint64(1))
+            w = (h[active] ^ words) * np.uint64(0x100000001B3)
+            h[active] = w ^ (w >> np.uint64(29))
+        h = (h ^ lengths.astype(np.uint64)) * np.uint64(0x100000001B3)
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(0xFF51AFD7ED558CCD)
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(0xC4CEB9FE1A85EC53)
+        h ^= h >> np.uint64(33)
+    return h
+
+def bit_length(w: np.ndarray) -> np.ndarray:
+    n = np.zeros(len(w), dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        big = w >= (np.uint64(1) << np.uint64(s))
+        n[big] += s
+        w = np.where(big, w >> np.uint64(s), w)
+    return n + (w > 0)
+
+class HyperLogLog():
+    def __init__(self, p: int = 12, registers: str = None):
+        self.p = p
+        self.registers = (np.frombuffer(base64.b64decode(registers), dtype=np.uint8).copy() if registers else np.zeros(1 << p, dtype=np.uint8))
+
+    def update(self, arr: pa.array):
+        arr = c.drop_null(arr).cast(pa.string()).unique() # HASH EVERY DISTINCT VALUE ONCE
+        if len(arr) == 0:
+            return
+        h, rest = hash_strings(arr), np.uint64(64 - self.p)
+        idx = (h >> rest).astype(np.int64)
+        rank = (64 - self.p) - bit_length(h & ((np.uint64(1) << rest) - np.uint64(1))) + 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def cardinality(self) -> int:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.sum(self.registers == 0))
+        if estimate <= 2.5 * m and zeros: # LINEAR COUNTING FOR SMALL CARDINALITIES
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> dict:
+        return {"p": self.p, "registers": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'HyperLogLog':
+        return cls(**state)
+
+# Heavy hitters: Misra-Gries counters, counts are underestimated by at most total / (capacity + 1)
+class FrequentItems():
+    def __init__(self, capacity: int = 1024, counts: dict = {}, total: int = 0):
+        self.capacity, self.counts, self.total = capacity, dict(counts), total
+
+    def add(self, values: List[str], counts: np.ndarray):
+        for v, n in zip(values, counts.tolist()):
+            self.counts[v] = self.counts.get(v, 0) + n
+        if len(self.counts) > self.capacity: # SUBTRACT THE (capacity + 1)TH LARGEST COUNT, KEEPS THE SKETCH MERGEABLE
+            keys, vals = list(self.counts.keys()), np.array(list(self.counts.values()), dtype=np.int64)
+            cut = np.partition(vals, len(vals) - self.capacity - 1)[len(vals) - self.capacity - 1]
+            self.counts = {k: int(v - cut) for k, v in zip(keys, vals) if v > cut}
+
+    def update(self, arr: pa.array):
+        vc = c.value_counts(c.drop_null(arr).cast(pa.string()))
+        self.total += int(c.sum(vc.field('counts')).as_py() or 0)
+        self.add(vc.field('values').to_pylist(), vc.field('counts').to_numpy())
+
+    def merge(self, other: 'FrequentItems'):
+        self.total += other.total
+        self.add(list(other.counts.keys()), np.array(list(other.counts.values()), dtype=np.int64))
+
+    def top(self, k: int = None) -> List[str]:
+        # MOST FREQUENT FIRST, TIES BY VALUE SO SHARDS AGREE ON THE ORDER
+        return [v for v, _ in sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))][:k]
+
+    def to_dict(self) -> dict:
+        return {"capacity": self.capacity, "counts": self.counts, "total": self.total}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'FrequentItems':
+        return cls(**state)
+
+class CategorySketch():
+    def __init__(self, capacity: int = 1024, hll: dict = None, frequent: dict = None):
+        self.hll = (HyperLogLog.from_dict(hll) if hll else HyperLogLog())
+        self.frequent = (FrequentItems.from_dict(frequent) if frequent else FrequentItems(capacity=capacity))
+
+    def update(self, arr: pa.array):
+        self.hll.update(arr)
+        self.frequent.update(arr)
+
+    def merge(self, other: 'CategorySketch'):
+        self.hll.merge(other.hll)
+        self.frequent.merge(other.frequent)
+
+    def cardinality(self) -> int:
+        return self.hll.cardinality()
+
+    def top(self, k: int = None) -> List[str]:
+        return self.frequent.top(k)
+
+    def to_dict(self) -> dict:
+        return {"hll": self.hll.to_dict(), "frequent": self.frequent.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'CategorySketch':
+        return cls(**state)
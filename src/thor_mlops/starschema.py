@@ -1,116 +1,454 @@
+import os
 import json
+import base64
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as c
-from typing import List, Tuple, Union
+from typing import Dict, Iterator, List, Tuple, Union
 
-from thor_mlops.ops import loads_json_column
-from thor_mlops.clean import ThorTableCleaner
+from thor_mlops.ops import loads_json_column, TableIndex
+from thor_mlops.clean import ThorTableCleaner, NumericalColumn, OneHotColumn, DtypePolicy
+from thor_mlops.metrics import ThorMetrics, NULL_METRICS
+
+class StarSchemaPlan():
+    def __init__(self, sts: 'ThorStarSchema', features: List[str] = None):
+        # FREEZE CALCULATION CLEANERS, MISSING FEATURE DEFAULTS AND OUTPUT NAMES (OF THE REQUESTED FEATURES)
+        self.sts, self.cleaner, self.subset = sts, sts.cln.compile(), (tuple(features) if features is not None else None)
+        appended = lambda col: not isinstance(col, OneHotColumn) or col.policy.one_hot == 'dictionary' # ONE COLUMN PER CATEGORY IS NOT APPENDED, A CATEGORICAL OF THE SAME CALCULATION IS
+        self.calculations = {k: (func, tuple((fields[0].name, fn) for col, (name, fields, fn) in zip(self.cleaner.columns, self.cleaner.steps) if name == k and appended(col))) for k, func in sts.calculations.items()}
+        self.fills = tuple((feat + '_c', col) for col in sts.cln.columns for feat in col.features() if self.subset is None or feat in self.subset)
+        self.features = tuple(feat + '_c' for feat in (self.subset if self.subset is not None else sts.cln.features()))
+        self.names = tuple(feat[:-2] for feat in self.features)
+        self.label, self.weight = sts.label, sts.weight
+
+    def enrich(self, base: pa.Table, metrics: ThorMetrics = NULL_METRICS) -> Tuple[pa.Table, pa.Table, pa.array, pa.array]:
+        tables, calculations = self.sts.graph(base.schema.names, self.subset)
+        for name in tables:
+            base = self.sts.join_table(base, name, metrics=metrics)
+
+        for k in calculations:
+            func, steps = self.calculations[k]
+            with metrics.stage('calculation', k, rows_in=base.num_rows):
+                arr = func(self.sts.calculation_input(base, k))
+                base = base.append_column(k, arr)
+                for feat, step in steps: # E.G. A CATEGORICAL AND A (DICTIONARY) ONE-HOT OF THE SAME CALCULATION
+                    base = base.append_column(feat + '_c', step(arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr)[0])
+
+        with metrics.stage('missing', rows_in=base.num_rows):
+            columns, missing = set(base.schema.names), {}
+            for feat, col in self.fills:
+                if feat not in columns and feat not in missing:
+                    missing[feat] = col.fill(base.num_rows)
+            if missing:
+                base = pa.Table.from_arrays(base.columns + list(missing.values()), names=base.schema.names + list(missing.keys()))
+
+        names = base.schema.names
+        return base.select([col for col in names if col[-2:] != '_c']), base.select(list(self.features)).rename_columns(list(self.names)), (base.column(self.label) if self.label and self.label in names else None), (base.column(self.weight) if self.weight and self.weight in names else None)
+
+# Sharded enrichment: forked workers inherit the registered tables (copy on write) and exchange shards as Arrow IPC files
+SHARDS = {}
+
+def write_ipc(table: pa.Table, path: str):
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def enrich_shard(task: Tuple[int, int, int, str, int, int]) -> Tuple[int, int]:
+    i, offset, length, name, t_offset, t_length = task
+    sts, base, path, features, indexed = SHARDS['sts'], SHARDS['base'], SHARDS['path'], SHARDS['features'], SHARDS['indexed']
+    v = sts.tables.get(name)
+    if v is not None: # ONLY JOIN A SLICE OF THE CROSS JOINED CORE TABLE
+        sts.tables[name] = dict(v, table=v['table'].slice(t_offset, t_length))
+    try:
+        context, X, _, _ = sts.enrich(base.slice(offset, length), indexed=indexed, features=features)
+    finally:
+        if v is not None: sts.tables[name] = v
+    write_ipc(context, os.path.join(path, 'context', f'part-{i:05d}.arrow'))
+    write_ipc(X, os.path.join(path, 'features', f'part-{i:05d}.arrow'))
+    return i, X.num_rows
 
 class ThorStarSchema():
-    def __init__(self, numericals: List[str], categoricals: List[str], one_hots: List[str], label: str, weight: str = None, config: dict = {}):
-        self.tables, self.calculations = {}, {}
+    def __init__(self, numericals: List[str], categoricals: List[str], one_hots: List[str], label: str, weight: str = None, config: dict = {}, policy: DtypePolicy = None):
+        self.tables, self.calculations, self.inputs, self.graphs = {}, {}, {}, {}
         self.numericals, self.categoricals, self.one_hots, self.label, self.weight, self.config = numericals, categoricals, one_hots, label, weight, config
         
         # Register TableCleaner
-        self.cln = ThorTableCleaner()
+        self.cln = ThorTableCleaner(policy=policy) # THE POLICY ALSO APPLIES TO THE CLEANED COLUMNS OF REGISTERED TABLES
         self.cln.register(numericals=numericals, categoricals=categoricals, one_hots=one_hots)
 
     # TRACKING TABLES
-    def clean_table(self, table: pa.Table, keys: List[str] = [], contexts: List[str] = [], json_columns: List[str] = []):
+    def clean_table(self, table: pa.Table, keys: List[str] = [], contexts: List[str] = [], json_columns: List[str] = [], json_schemas: Dict[str, pa.Schema] = {}, metrics: ThorMetrics = NULL_METRICS):
         # CLEAN JSON STRINGS TO COLUMNS
         for col in json_columns:
-            table = loads_json_column(table=table, column=col, drop=True)
-
-        # CLEAN TABLE AND APPEND TO DEFAULT TABLE WITH PREFIX
-        clean,_ = self.cln.transform(table=table, warn_missing=False)
-        for col in clean.column_names:
-            table = table.append_column(col + "_c", clean.column(col))
+            with metrics.stage('json', col, rows_in=table.num_rows):
+                table = loads_json_column(table=table, column=col, drop=True, schema=json_schemas.get(col))
 
-        # REMOVE ALL COLUMNS WHICH ARE NOT IN KEYS OR CONTEXTS
-        table = table.select([col for col in table.column_names if col in keys or col in contexts or col[-2:] == '_c'])
-        return table
+        # CLEAN TABLE AND KEEP KEYS, CONTEXTS AND CLEANED COLUMNS (WITH SUFFIX) IN ONE PASS
+        clean,_ = self.cln.transform(table=table, warn_missing=False, metrics=metrics)
+        names = [col for col in table.column_names if col in keys or col in contexts or col[-2:] == '_c']
+        return pa.Table.from_arrays([table.column(col) for col in names] + clean.columns, names=names + [col + "_c" for col in clean.column_names])
 
-    def register_table(self, name: str, table: pa.Table, keys: List[str], contexts: List[str] = [], core: bool = False, json_columns: List[str] = []):
+    def register_table(self, name: str, table: pa.Table, keys: List[str], contexts: List[str] = [], core: bool = False, json_columns: List[str] = [], json_schemas: Dict[str, pa.Schema] = {}, metrics: ThorMetrics = NULL_METRICS):
         assert all(k in table.column_names for k in keys)
 
         # CLEAN & SAVE TABLE
+        table = self.clean_table(table=table, keys=keys, contexts=contexts, json_columns=json_columns, json_schemas=json_schemas, metrics=metrics)
+        self.graphs = {}
         self.tables[name] = {
-            'table': self.clean_table(table=table, keys=keys, contexts=contexts, json_columns=json_columns),
+            'table': table,
+            'index': (TableIndex(table=table, keys=keys) if keys else None), # NO KEYS: ALWAYS CROSS JOINED
             'keys': keys,
             'contexts': contexts,
-            'core': core
+            'core': core,
+            'json_columns': json_columns,
+            'json_schemas': json_schemas
         }
 
-    def register_calculation(self, name: str, func):
-        self.calculations[name] = func
+    def register_calculation(self, name: str, func, inputs: List[str] = None):
+        # inputs ARE THE COLUMNS func READS, WITHOUT THEM IT DEPENDS ON ALL TABLES AND EARLIER CALCULATIONS
+        self.calculations[name], self.inputs[name] = func, inputs
+        self.graphs = {}
+
+    def calculation_input(self, base: pa.Table, k: str) -> pa.Table:
+        # CALCULATIONS SEE CLEANED NUMERICALS AS float32: _c COLUMNS ENCODED BY THE FLOAT POLICY (float16 HAS NO ARITHMETIC, uint8 / uint16 ARE QUANTIZATION CODES) ARE DECODED
+        inputs, names = self.inputs.get(k), set(base.column_names)
+        decoders = {col.name + '_c': col for col in self.cln.columns if isinstance(col, NumericalColumn) and col.policy.floats is not None and col.name + '_c' in names and (inputs is None or col.name + '_c' in inputs)}
+        if not decoders:
+            return base
+        return pa.Table.from_arrays([(decoders[name].decode(arr) if name in decoders else arr) for name, arr in zip(base.column_names, base.columns)], names=base.column_names)
+
+    # DEPENDENCY GRAPH
+    def graph(self, columns: List[str], features: List[str] = None) -> Tuple[Tuple[str], Tuple[str]]:
+        # TABLES TO JOIN (REGISTRATION ORDER) AND CALCULATIONS TO RUN (DEPENDENCY ORDER) FOR THE REQUESTED FEATURES, LABEL AND WEIGHT
+        key = (tuple(columns), (tuple(features) if features is not None else None))
+        if key in self.graphs:
+            return self.graphs[key]
+
+        owners = {feat: col.name for col in self.cln.columns for feat in col.features()}
+        unknown = [feat for feat in (features or []) if feat not in owners]
+        if unknown:
+            raise Exception(f"Unknown features: {unknown}")
+        providers, calcs = {}, list(self.calculations.keys())
+        for name, v in self.tables.items():
+            for col in v['table'].column_names:
+                if col not in v['keys']:
+                    providers.setdefault(col, []).append(name)
+
+        tables, order, visiting, present = set(), [], set(), set(columns)
+        def need_table(name: str):
+            if name not in tables:
+                tables.add(name)
+                [need_column(k) for k in self.tables[name]['keys']] # KEYS MAY COME FROM CONTEXTS OF OTHER TABLES
+
+        def need_column(col: str):
+            calc = (col if col in self.calculations else col[:-2] if col[-2:] == '_c' and col[:-2] in self.calculations else None)
+            if calc: need_calculation(calc)
+            if col not in present: # COLUMNS OF THE BASE (E.G. KEYS) NEED NO PROVIDER
+                [need_table(name) for name in providers.get(col, [])] # ALL PROVIDERS, THEIR VALUES ARE COALESCED
+
+        def need_calculation(k: str):
+            if k in order:
+                return
+            if k in visiting:
+                raise Exception(f"Calculation {k} depends on itself")
+            visiting.add(k)
+            if self.inputs.get(k) is None:
+                [need_table(name) for name in self.tables]
+                [need_calculation(j) for j in calcs[:calcs.index(k)]]
+            else:
+                [need_column(col) for col in self.inputs[k]]
+            order.append(k)
+
+        if features is None: # EVERYTHING, CALCULATIONS STILL IN DEPENDENCY ORDER
+            [need_table(name) for name in self.tables]
+            [need_calculation(k) for k in calcs]
+            features = []
+        [need_table(name) for name, v in self.tables.items() if v['core']] # CORE TABLES DETERMINE THE ROWS
+        for feat in features:
+            if owners[feat] in self.calculations: need_calculation(owners[feat])
+            need_column(feat + '_c')
+        [need_column(col) for col in (self.label, self.weight) if col]
+        self.graphs[key] = (tuple(name for name in self.tables if name in tables), tuple(order))
+        return self.graphs[key]
     
+    # INCREMENTAL UPDATES (CLEAN ONLY THE CHANGED ROWS WITH THE FITTED CLEANER)
+    def clean_delta(self, name: str, delta: pa.Table) -> pa.Table:
+        v = self.tables[name]
+        assert all(k in delta.column_names for k in v['keys'])
+        for col in v['json_columns']:
+            if col in delta.column_names:
+                delta = loads_json_column(table=delta, column=col, drop=True, schema=v['json_schemas'].get(col))
+
+        # ONLY CLEAN COLUMNS THE REGISTERED TABLE HAS, MISSING ONES ARE CLEANED AS NULLS (IMPUTED) LIKE IN A FULL REGISTER
+        schema = v['table'].schema
+        cleaned = [col.name for col in self.cln.columns if any(feat + '_c' in schema.names for feat in col.features())]
+        names = [col for col in delta.column_names if col in v['keys'] or col in v['contexts'] or col in cleaned]
+        nulls = [col for col in cleaned if col not in delta.column_names]
+        delta = pa.Table.from_arrays([delta.column(col) for col in names] + [pa.nulls(delta.num_rows) for _ in nulls], names=names + nulls)
+        delta = self.clean_table(table=delta, keys=v['keys'], contexts=v['contexts'])
+
+        # CONFORM TO THE REGISTERED SCHEMA
+        arrays = []
+        for f in schema:
+            if f.name in delta.column_names:
+                arrays.append(delta.column(f.name).cast(f.type))
+            elif f.name == '$join_key':
+                arrays.append(pa.repeat(pa.scalar(0, pa.int8()), delta.num_rows))
+            else:
+                arrays.append(pa.nulls(delta.num_rows, f.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def upsert_table(self, name: str, delta: pa.Table, compact: float = 0.25):
+        # REPLACE ROWS WITH THE SAME KEYS AND APPEND NEW KEYS, COST SCALES WITH THE DELTA FOR UNIQUELY KEYED TABLES
+        v = self.keyed_table(name)
+        delta = self.clean_delta(name, delta)
+        if v['index'].unique:
+            if not TableIndex(table=delta, keys=v['keys']).unique:
+                raise Exception(f"Delta for table {name} contains duplicate keys")
+            offset = v['table'].num_rows
+            v['table'] = pa.concat_tables([v['table'], delta]) # NEW CHUNKS, EXISTING ROWS ARE NOT COPIED
+            v['index'].upsert(delta.select(v['keys']), np.arange(offset, offset + delta.num_rows))
+            if v['index'].pending() > compact * max(v['index'].num_rows, 1):
+                self.compact_table(name)
+        else: # DUPLICATE KEYS: REPLACE ALL ROWS OF A KEY AND REBUILD
+            keep = TableIndex(table=delta, keys=v['keys']).lookup(v['table']) < 0
+            v['table'] = pa.concat_tables([v['table'].filter(pa.array(keep)), delta])
+            v['index'] = TableIndex(table=v['table'], keys=v['keys'])
+
+    def delete_keys(self, name: str, keys: pa.Table, compact: float = 0.25):
+        v = self.keyed_table(name)
+        keys = pa.Table.from_arrays([keys.column(k).cast(v['table'].schema.field(k).type) for k in v['keys']], names=v['keys'])
+        if v['index'].unique:
+            v['index'].upsert(keys, np.full(keys.num_rows, -1, dtype=np.int64))
+            if v['index'].pending() > compact * max(v['index'].num_rows, 1):
+                self.compact_table(name)
+        else:
+            v['table'] = v['table'].filter(pa.array(TableIndex(table=keys, keys=v['keys']).lookup(v['table']) < 0))
+            v['index'] = TableIndex(table=v['table'], keys=v['keys'])
+
+    def keyed_table(self, name: str) -> dict:
+        v = self.tables[name]
+        if v['index'] is None:
+            raise Exception(f"Table {name} has no keys to update rows by, register it again instead")
+        return v
+
+    def live_table(self, name: str) -> pa.Table:
+        # REGISTERED TABLE WITHOUT REPLACED / DELETED ROWS
+        v = self.tables[name]
+        return (v['table'].filter(pa.array(v['index'].live(v['table'].num_rows))) if v['index'] is not None and v['index'].pending() else v['table'])
+
+    def compact_table(self, name: str):
+        # DROP REPLACED / DELETED ROWS AND REBUILD THE INDEX (AMORTIZED OVER MANY UPDATES)
+        v = self.tables[name]
+        if v['index'] is not None and v['index'].pending():
+            v['table'] = self.live_table(name).combine_chunks()
+            v['index'] = TableIndex(table=v['table'], keys=v['keys'])
+
     # ENRICHING
-    def enrich(self, base: pa.Table, verbose: bool = False) -> pa.Table:
-        for k, v in self.tables.items():
-            start_size = base.num_rows
-            keys_overlap = [k for k in v['keys'] if k in base.column_names]
-            if not keys_overlap:
-                if not v['core']: # AVOID CROSS JOINING NON CORE TABLES
-                    if verbose: print(f"Avoiding cross join for table {k}, since it is not core and has no overlapping keys")
-                    continue
-                if '$join_key' not in base.column_names: base = base.append_column('$join_key', pa.array([0] * base.num_rows, pa.int8()))
-                if '$join_key' not in v['table'].column_names: v['table'] = v['table'].append_column('$join_key', pa.array([0] * v['table'].num_rows, pa.int8()))
-                keys_overlap = '$join_key'
-            join_method = ('inner' if v['core'] else 'left outer')
-            base = base.join(v['table'], keys=keys_overlap, join_type=join_method, right_suffix='_r')
-
-            if verbose: print(f"Size after {join_method} joining {k} on {keys_overlap}: {base.num_rows} rows")
-            if not v['core']: assert base.num_rows == start_size # WE DO NOT WANT TO GROW ON NON-CORE TABLE JOINS
-
-            # COALESCE WHEN MULTIPLE VALUES ARE FOUND
-            for col in base.column_names:
-                if col[-2:] == '_r':
-                    if verbose: print(f"Coalescing double columns {col}")
-                    arr = c.coalesce(base.column(col[:-2]), base.column(col))
-                    base = base.drop([col, col[:-2]]).append_column(col[:-2], arr)
+    def lookup_table(self, base: pa.Table, name: str) -> pa.Table:
+        # JOIN BY TAKING ROWS FROM THE REGISTERED INDEX, COST SCALES WITH THE BASE INSTEAD OF THE DIMENSION TABLE
+        v = self.tables[name]
+        positions = v['index'].lookup(base)
+        if v['core']: # INNER JOIN DROPS UNMATCHED ROWS
+            matched = positions >= 0
+            if not matched.all():
+                base, positions = base.filter(pa.array(matched)), positions[matched]
+            right = v['table'].drop(v['keys']).take(pa.array(positions))
+        else:
+            right = v['table'].drop(v['keys']).take(pa.array(positions, mask=positions < 0))
+        names = set(base.column_names)
+        return pa.Table.from_arrays(base.columns + right.columns, names=base.column_names + [(col + '_r' if col in names else col) for col in right.column_names])
+
+    def join_table(self, base: pa.Table, name: str, verbose: bool = False, indexed: bool = True, metrics: ThorMetrics = NULL_METRICS) -> pa.Table:
+        v = self.tables[name]
+        start_size = base.num_rows
+        keys_overlap = [k for k in v['keys'] if k in base.column_names]
+        if not keys_overlap:
+            if not v['core']: # AVOID CROSS JOINING NON CORE TABLES
+                if verbose: print(f"Avoiding cross join for table {name}, since it is not core and has no overlapping keys")
+                return base
+            if '$join_key' not in base.column_names: base = base.append_column('$join_key', pa.repeat(pa.scalar(0, pa.int8()), base.num_rows))
+            if '$join_key' not in v['table'].column_names: v['table'] = v['table'].append_column('$join_key', pa.repeat(pa.scalar(0, pa.int8()), v['table'].num_rows))
+            keys_overlap = '$join_key'
+        join_method = ('inner' if v['core'] else 'left outer')
+        with metrics.stage('join', name, rows_in=start_size) as stage:
+            if indexed and v.get('index') and v['index'].unique and sorted(keys_overlap) == sorted(v['keys']):
+                base = self.lookup_table(base, name)
+            else:
+                base = base.join(self.live_table(name), keys=keys_overlap, join_type=join_method, right_suffix='_r')
+            stage.rows_out = base.num_rows
+
+        if verbose: print(f"Size after {join_method} joining {name} on {keys_overlap}: {base.num_rows} rows")
+        if not v['core']: assert base.num_rows == start_size # WE DO NOT WANT TO GROW ON NON-CORE TABLE JOINS
+
+        # COALESCE WHEN MULTIPLE VALUES ARE FOUND (COALESCED COLUMNS MOVE TO THE END)
+        doubles = [col for col in base.column_names if col[-2:] == '_r']
+        if not doubles:
+            return base
+        if verbose: [print(f"Coalescing double columns {col}") for col in doubles]
+        with metrics.stage('coalesce', name, rows_in=base.num_rows):
+            dropped = set(doubles) | {col[:-2] for col in doubles}
+            names = [col for col in base.column_names if col not in dropped]
+            arrays = [base.column(col) for col in names] + [c.coalesce(base.column(col[:-2]), base.column(col)) for col in doubles]
+            return pa.Table.from_arrays(arrays, names=names + [col[:-2] for col in doubles])
+
+    def enrich(self, base: pa.Table, verbose: bool = False, indexed: bool = True, metrics: ThorMetrics = NULL_METRICS, features: List[str] = None) -> pa.Table:
+        # PASS A ThorMetrics TO RECORD TIME, ROWS AND ARROW ALLOCATIONS PER JOIN, COALESCE, CALCULATION, MISSING FILL, JSON COLUMN AND CLEANED COLUMN
+        # PASS features TO ONLY JOIN THE TABLES AND RUN THE CALCULATIONS THEY (AND THE LABEL / WEIGHT) NEED
+        tables, calculations = self.graph(base.column_names, features)
+        if verbose and features is not None: print(f"Joining tables {list(tables)} and calculating {list(calculations)} for {len(features)} features")
+        for k in tables:
+            base = self.join_table(base, k, verbose=verbose, indexed=indexed, metrics=metrics)
 
         # PERFORM CALCULATIONS
-        for k, func in self.calculations.items():
+        columns = {}
+        for col in self.cln.columns:
+            columns.setdefault(col.name, []).append(col)
+        for k in calculations:
             # PERFORM CALCULATION & CLEAN & APPEND
-            base = base.append_column(k, func(base))
-            tc = self.clean_table(table=base.select([k]))
-            if k + '_c' in tc.column_names:
-                base = base.append_column(k + '_c', tc.column(k + '_c'))
+            with metrics.stage('calculation', k, rows_in=base.num_rows):
+                base = base.append_column(k, self.calculations[k](self.calculation_input(base, k)))
+            for col in columns.get(k, []):
+                names, arrays = self.cln.clean_column(base, col, metrics=metrics)
+                if not isinstance(col, OneHotColumn) or col.policy.one_hot == 'dictionary': # ONE-HOT CALCULATIONS ARE ONLY APPENDED IN THE DICTIONARY LAYOUT (ONE FEATURE)
+                    base = base.append_column(names[0] + '_c', arrays[0])
 
         # ADD MISSING FEATURES
-        for col in self.cln.columns:
-            for feat in col.features():
-                if feat + "_c" not in base.column_names: 
-                    if verbose: print(f"Adding missing feature {feat} with default value {col.fill_value}")
-                    base = base.append_column(feat + "_c", pa.array([col.fill_value] * base.num_rows))
+        requested = (set(features) if features is not None else None)
+        with metrics.stage('missing', rows_in=base.num_rows):
+            names, missing = set(base.column_names), {}
+            for col in self.cln.columns:
+                for feat in col.features():
+                    if (requested is None or feat in requested) and feat + "_c" not in names and feat + "_c" not in missing:
+                        if verbose: print(f"Adding missing feature {feat} with default value {col.fill_value}")
+                        missing[feat + "_c"] = col.fill(base.num_rows)
+            if missing:
+                base = pa.Table.from_arrays(base.columns + list(missing.values()), names=base.column_names + list(missing.keys()))
 
         # RETURN DATA
-        features = [col + '_c' for col in self.cln.features()]
+        features = [col + '_c' for col in (features if features is not None else self.cln.features())]
         if verbose: print("Features:", features)
         if verbose: print("Unclean columns:", self.cln.uninitialized())
         if verbose: print("Base columns:", base.column_names)
-        return base.select([col for col in base.column_names if col[-2:] != '_c']), base.select(features).rename_columns(map(lambda x: x[:-2], features)), (base.column(self.label) if self.label and self.label in base.column_names else None), (base.column(self.weight) if self.weight and self.weight in base.column_names else None)
+        return base.select([col for col in base.column_names if col[-2:] != '_c']), base.select(features).rename_columns([col[:-2] for col in features]), (base.column(self.label) if self.label and self.label in base.column_names else None), (base.column(self.weight) if self.weight and self.weight in base.column_names else None)
+
+    def shards(self, base: pa.Table, shard_rows: int = 1_000_000) -> List[Tuple[int, int, int, str, int, int]]:
+        # (SHARD, BASE OFFSET, BASE LENGTH, CROSS JOINED TABLE, TABLE OFFSET, TABLE LENGTH) WITH ABOUT shard_rows OUTPUT ROWS EACH
+        cross = [name for name, v in self.tables.items() if v['core'] and not any(k in base.column_names for k in v['keys'])]
+        growth = self.growth_rate(base)
+        if growth <= shard_rows or not cross: # SPLIT THE BASE
+            step = max(shard_rows // max(growth, 1), 1)
+            return [(i, offset, step, None, 0, None) for i, offset in enumerate(range(0, max(base.num_rows, 1), step))]
+
+        # ONE BASE ROW ALREADY EXCEEDS A SHARD, ALSO SPLIT THE LARGEST CROSS JOINED TABLE (IN AS MANY SLICES AS KEEP SHARDS NEAR shard_rows)
+        name = max(cross, key=lambda n: self.tables[n]['table'].num_rows)
+        rows = self.tables[name]['table'].num_rows
+        step = max(-(-rows // max(round(growth / shard_rows), 1)), 1)
+        length = max(round(shard_rows * rows / (growth * step)), 1) # BASE ROWS PER SHARD WHEN A SLICE IS SMALLER THAN A SHARD
+        return [(i, offset, length, name, t_offset, step) for i, (offset, t_offset) in enumerate((o, t) for o in range(0, base.num_rows, length) for t in range(0, rows, step))]
+
+    def enrich_sharded(self, base: pa.Table, path: str = None, shard_rows: int = 1_000_000, processes: int = None, features: List[str] = None, indexed: bool = True) -> Iterator[Tuple[pa.Table, pa.Table, pa.array, pa.array]]:
+        # ENRICH SHARDS OF THE BASE (AND OF CROSS JOINED CORE TABLES) IN A PROCESS POOL, YIELDING (context, X, y, w) PER SHARD IN ORDER
+        # SHARDS ARE WRITTEN AS ARROW IPC FILES TO path/context AND path/features (A TEMPORARY DIRECTORY IF NOT GIVEN) AND MEMORY MAPPED
+        # CALCULATIONS MUST BE FITTED FIRST (E.G. BY enrich() OF A SAMPLE OF THE BASE), A SHARD ONLY SEES A SLICE OF THE DATA
+        _, calculations = self.graph(base.column_names, features)
+        unfitted = [k for k in calculations if k in set(self.cln.uninitialized())]
+        if unfitted:
+            raise Exception(f"Calculations {unfitted} are not fitted, enrich (a sample of) the base before enrich_sharded")
+        [self.compact_table(name) for name in self.tables] # WORKERS SLICE THE LIVE TABLES
+        tmp, path = (path is None), (path or tempfile.mkdtemp())
+        os.makedirs(os.path.join(path, 'context'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'features'), exist_ok=True)
+
+        def read(i: int) -> Tuple[pa.Table, pa.Table, pa.array, pa.array]:
+            context = pa.ipc.open_file(pa.memory_map(os.path.join(path, 'context', f'part-{i:05d}.arrow'))).read_all()
+            X = pa.ipc.open_file(pa.memory_map(os.path.join(path, 'features', f'part-{i:05d}.arrow'))).read_all()
+            return context, X, (context.column(self.label) if self.label and self.label in context.column_names else None), (context.column(self.weight) if self.weight and self.weight in context.column_names else None)
+
+        tasks = self.shards(base, shard_rows=shard_rows)
+        SHARDS.update(sts=self, base=base, path=path, features=features, indexed=indexed)
+        try:
+            if processes == 1 or len(tasks) == 1:
+                for task in tasks:
+                    yield read(enrich_shard(task)[0])
+            else:
+                with multiprocessing.get_context('fork').Pool(processes) as pool:
+                    for i, _ in pool.imap(enrich_shard, tasks):
+                        yield read(i)
+        finally:
+            SHARDS.clear()
+            if tmp: shutil.rmtree(path, ignore_errors=True) # MAPPED SHARDS STAY READABLE
+
+    def compile(self, features: List[str] = None) -> StarSchemaPlan:
+        return StarSchemaPlan(self, features=features)
 
     def growth_rate(self, base: pa.Table) -> int:
         rate = 1
-        for _, v in self.tables.items():
+        for name, v in self.tables.items():
             if v['core']: # WE CAN ONLY GROW FROM CORE FEATURES
                 keys_overlap = [k for k in v['keys'] if k in base.column_names]
                 if not keys_overlap: # WE ONLY GROW WHEN THERE IS A CROSS JOIN (NO KEYS OVERLAP)
-                    rate *= v['table'].num_rows
+                    rate *= self.live_table(name).num_rows
         return rate
 
+    # FEATURE STORE (CLEANED & INDEXED TABLES AS ARROW IPC FILES, MEMORY MAPPED ON LOAD)
+    def fingerprint(self) -> str:
+        # VOCABULARIES ARE HASHED AS ARROW BUFFERS, SO A BINARY LOADED CLEANER STAYS LAZY
+        cleaner = {'columns': [(col.to_dict() if isinstance(col, NumericalColumn) else col.to_dict(categories=False)) for col in self.cln.columns], 'policy': self.cln.policy.to_dict()}
+        return hashlib.sha256(json.dumps(dict(self.to_dict(cleaner=False), cleaner=cleaner), sort_keys=True, default=str).encode()).hexdigest()
+
+    def save_tables(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        manifest = {'fingerprint': self.fingerprint(), 'tables': {}}
+        for name, v in self.tables.items():
+            self.compact_table(name) # THE INDEX FILES HOLD NO PENDING CHANGES
+            with pa.OSFile(os.path.join(path, name + '.arrow'), 'wb') as sink, pa.ipc.new_file(sink, v['table'].schema) as writer:
+                writer.write_table(v['table'])
+            schemas = {col: base64.b64encode(schema.serialize().to_pybytes()).decode() for col, schema in v['json_schemas'].items()}
+            manifest['tables'][name] = {'keys': v['keys'], 'contexts': v['contexts'], 'core': v['core'], 'json_columns': v['json_columns'], 'json_schemas': schemas, 'index': (v['index'].save(os.path.join(path, name)) if v['index'] is not None else None)}
+
+        # WRITE MANIFEST LAST, SO READERS NEVER SEE A HALF WRITTEN STORE
+        with open(os.path.join(path, 'manifest.json.tmp'), 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+
+    def load_tables(self, path: str, mmap: bool = True) -> bool:
+        # RETURNS FALSE WHEN THERE IS NO STORE OR IT WAS WRITTEN WITH ANOTHER CLEANER CONFIG (RE-REGISTER THE TABLES THEN)
+        if not os.path.exists(os.path.join(path, 'manifest.json')):
+            return False
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        if manifest['fingerprint'] != self.fingerprint():
+            return False
+        self.graphs = {}
+        for name, v in manifest['tables'].items():
+            source = (pa.memory_map(os.path.join(path, name + '.arrow'), 'r') if mmap else pa.OSFile(os.path.join(path, name + '.arrow'), 'rb'))
+            self.tables[name] = {
+                'table': pa.ipc.open_file(source).read_all(),
+                'index': (TableIndex.load(os.path.join(path, name), state=v['index'], mmap=mmap) if v['index'] is not None else None),
+                'keys': v['keys'],
+                'contexts': v['contexts'],
+                'core': v['core'],
+                'json_columns': v.get('json_columns', []),
+                'json_schemas': {col: pa.ipc.read_schema(pa.py_buffer(base64.b64decode(schema))) for col, schema in v.get('json_schemas', {}).items()}
+            }
+        return True
+
     # SERIALIZATION
-    def to_dict(self):
-        return {
+    def to_dict(self, cleaner: bool = True):
+        state = {
             'numericals': self.numericals,
             'categoricals': self.categoricals,
             'one_hots': self.one_hots,
             'label': self.label,
             'weight': self.weight,
             'config': self.config,
-            'cleaner': self.cln.to_dict() 
         }
+        if cleaner: state['cleaner'] = self.cln.to_dict()
+        return state
 
     def to_json(self, path: str):
         with open(path, 'w') as f:
@@ -128,5 +466,20 @@ class ThorStarSchema():
             state = json.load(f)
         return cls.from_dict(state)
 
+    # BINARY SERIALIZATION (FAST COLD START, SEE ThorTableCleaner.save)
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.cln.save(os.path.join(path, 'cleaner'))
+        with open(os.path.join(path, 'schema.json'), 'w') as f:
+            json.dump(self.to_dict(cleaner=False), f, indent=4)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ThorStarSchema':
+        with open(os.path.join(path, 'schema.json'), 'r') as f:
+            state = json.load(f)
+        sts = ThorStarSchema(numericals=state['numericals'], categoricals=state['categoricals'], one_hots=state['one_hots'], label=state['label'], weight=state['weight'], config=state['config'])
+        sts.cln = ThorTableCleaner.load(os.path.join(path, 'cleaner'), mmap=mmap)
+        return sts
+
 
 
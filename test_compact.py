@@ -0,0 +1,66 @@
+import pyarrow as pa
+import pyarrow.compute as c
+from thor_mlops.clean import ThorTableCleaner, DtypePolicy
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.ops import head
+
+# The test_ml.py flow with the compact policy: Animal is both a categorical and a (dictionary) one-hot
+t1 = pa.Table.from_pydict({
+    'Animal': ['Falcon', 'Falcon', 'Parrot', 'Parrot', 'Parrot'],
+    'Max Speed': [380., 370., None, 26., 24.],
+    'Value': [2000, 1500, 10, 30, 20],
+})
+
+cleaner = ThorTableCleaner(policy=DtypePolicy.compact())
+cleaner.register_numerical('Max Speed', impute='min', clip=True)
+cleaner.register_categorical('Animal')
+cleaner.register_one_hot('Animal')
+
+X, y = cleaner.transform(t1, label='Value')
+head(X)
+assert X.column_names == ['Max Speed', 'Animal', 'Animal_onehot'] == cleaner.features()
+assert cleaner.align(X, y).column_names == ['label', 'Max Speed', 'Animal', 'Animal_onehot']
+
+X = cleaner.mutate(X, seed=0)
+X_train, y_train, X_test, y_test = cleaner.split(X=X, y=y, perc=0.5)
+
+# Decoding gives the categorical back as int64 and expands the one-hot
+decoded = cleaner.decode(cleaner.transform(t1)[0])
+assert decoded.column_names == ['Max Speed', 'Animal', 'Animal_Falcon', 'Animal_Parrot']
+assert decoded.column('Animal').type == pa.int64() and decoded.column('Animal').to_pylist() == [1, 1, 2, 2, 2]
+
+cleaner.to_json('schema.json')
+t2 = pa.Table.from_pydict({
+    'Animal': ['Falcon', 'Goose', 'Parrot', 'Parrot'],
+    'Max Speed': [380., 10., None, 26.]
+})
+X, _ = ThorTableCleaner.from_json('schema.json').transform(t2)
+head(X)
+assert X.column('Animal_onehot').null_count == 1
+
+# Same in a star schema, with a calculation that is both a categorical and a one-hot
+skus = pa.table({'sku': [1, 2, 3], 'brand': ['a', 'b', 'a']})
+base = pa.table({'sku': [1, 2, 3, 4]})
+sts = ThorStarSchema(numericals=[], categoricals=['brand', 'brand_upper'], one_hots=['brand', 'brand_upper'], label=None, policy=DtypePolicy.compact())
+sts.register_table(name='skus', table=skus, keys=['sku'], contexts=['brand'])
+sts.register_calculation(name='brand_upper', func=lambda t: c.utf8_upper(t.column('brand')), inputs=['brand'])
+sts.enrich(base) # MEASURE THE CALCULATION BEFORE COMPILING
+for enrich in [sts.enrich, sts.compile().enrich]:
+    context, X, _, _ = enrich(base)
+    head(X)
+    assert X.column_names == ['brand', 'brand_upper', 'brand_onehot', 'brand_upper_onehot']
+    assert X.column('brand').to_pylist()[:3] == X.column('brand_upper').to_pylist()[:3] == [1, 2, 1]
+    assert X.column('brand_upper_onehot').to_pylist()[:3] == ['A', 'B', 'A']
+
+# Calculations read cleaned numericals as float32, whatever the float policy stores
+prices = pa.table({'sku': [1, 2, 3], 'price': [10., 50., 100.]})
+for floats in ['uint8', 'float16']:
+    sts = ThorStarSchema(numericals=['price', 'double_price'], categoricals=[], one_hots=[], label=None, policy=DtypePolicy(floats=floats))
+    sts.register_table(name='skus', table=prices, keys=['sku'])
+    sts.register_calculation(name='double_price', func=lambda t: c.multiply(t.column('price_c'), 2), inputs=['price_c'])
+    sts.enrich(prices.select(['sku'])) # MEASURE THE CALCULATION BEFORE COMPILING
+    for enrich in [sts.enrich, sts.compile().enrich]:
+        context, X, _, _ = enrich(prices.select(['sku']))
+        assert context.column('double_price').type == pa.float32()
+        assert [round(v) for v in context.column('double_price').to_pylist()] == [20, 100, 200]
+        assert [round(v) for v in sts.cln.decode(X).column('double_price').to_pylist()] == [20, 100, 200]
@@ -0,0 +1,34 @@
+import pyarrow as pa
+import pyarrow.compute as c
+from thor_mlops.clean import ThorTableCleaner
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.ops import head
+
+# Compiled plans return the same features as transform / enrich
+skus = pa.table({'sku': [1, 2, 3], 'price': [10., None, 30.], 'brand': ['a', 'b', 'a'], 'season': ['SS', 'AW', None]})
+stores = pa.table({'store': [1, 2], 'size': [100., 200.]})
+base = pa.table({'sku': [1, 2, 3, 4, 1], 'store': [1, 1, 2, 2, 3], 'y': [1, 0, 1, 0, 1]})
+
+cln = ThorTableCleaner()
+cln.register(numericals=['price'], categoricals=['brand'], one_hots=['season'])
+X, _ = cln.transform(skus)
+assert cln.compile().transform(skus)[0].equals(X)
+assert cln.compile().transform(skus.slice(1, 1))[0].equals(cln.transform(skus.slice(1, 1))[0])
+
+# A calculation registered both as a categorical and as a (bool) one-hot keeps its categorical in the compiled plan
+sts = ThorStarSchema(numericals=['price', 'size', 'price_per_size'], categoricals=['brand', 'brand_upper'], one_hots=['season', 'brand_upper'], label='y')
+sts.register_table(name='skus', table=skus, keys=['sku'], contexts=['brand'])
+sts.register_table(name='stores', table=stores, keys=['store'])
+sts.register_calculation(name='price_per_size', func=lambda t: c.divide(t.column('price_c'), t.column('size_c')), inputs=['price_c', 'size_c'])
+sts.register_calculation(name='brand_upper', func=lambda t: c.utf8_upper(t.column('brand')), inputs=['brand'])
+sts.enrich(base) # MEASURE THE CALCULATIONS BEFORE COMPILING
+
+plan = sts.compile()
+for rows in [base, base.slice(0, 1), base.slice(3, 2)]:
+    context, X, y, _ = sts.enrich(rows)
+    context_c, X_c, y_c, _ = plan.enrich(rows)
+    head(X_c)
+    assert X_c.column_names == X.column_names
+    assert X_c.to_pydict() == X.to_pydict(), (X_c.to_pydict(), X.to_pydict())
+    assert y_c.to_pylist() == y.to_pylist()
+assert plan.enrich(base)[1].column('brand_upper').to_pylist() == [1, 2, 1, None, 1]
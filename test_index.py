@@ -0,0 +1,50 @@
+import tempfile
+import pyarrow as pa
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.ops import head, TableIndex
+
+# Composite keys (sku x store) that are missing in the registered table
+ss = pa.table({'sku': [1, 1, 2], 'store': [1, 2, 1], 'sales': [1., 2., 3.]})
+base = pa.table({'sku': [1, 2, 2, 3], 'store': [2, 1, 2, 1]})
+
+sts = ThorStarSchema(numericals=['sales'], categoricals=[], one_hots=[], label=None)
+sts.register_table(name='sku_stores', table=ss, keys=['sku', 'store'])
+context, X, _, _ = sts.enrich(base)
+head(X)
+assert X.column('sales').null_count == 2
+
+# Upserting a new composite key, then compacting the table
+sts.upsert_table('sku_stores', pa.table({'sku': [2], 'store': [2], 'sales': [4.]}))
+sts.compact_table('sku_stores')
+context, X, _, _ = sts.enrich(base)
+head(X)
+assert X.column('sales').null_count == 1
+
+# Integer keys with nulls stay exact (no float64 round trip) and strings are compared byte for byte
+index = TableIndex(pa.table({'key': pa.array([2 ** 53, 2 ** 53 + 1, None], pa.int64())}), keys=['key'])
+assert index.lookup(pa.table({'key': pa.array([2 ** 53 + 1, 2 ** 53, None], pa.int64())})).tolist() == [1, 0, -1]
+index = TableIndex(pa.table({'key': ['a', 'a\x00', None]}), keys=['key'])
+assert index.lookup(pa.table({'key': ['a\x00', 'a', None, '']})).tolist() == [1, 0, -1, -1]
+
+# A core table without keys is cross joined (and not indexed)
+sts = ThorStarSchema(numericals=['sales', 'weight'], categoricals=[], one_hots=[], label=None)
+sts.register_table(name='sku_stores', table=ss, keys=['sku', 'store'])
+sts.register_table(name='scenarios', table=pa.table({'weight': [0.5, 1.5]}), keys=[], core=True)
+context, X, _, _ = sts.enrich(pa.table({'sku': [1, 2], 'store': [1, 1]}))
+assert X.num_rows == 4 and sorted(X.column('weight').to_pylist()) == [0.5, 0.5, 1.5, 1.5]
+assert sts.live_table('scenarios').num_rows == 2
+sts.compact_table('scenarios')
+try:
+    sts.upsert_table('scenarios', pa.table({'weight': [2.5]}))
+    raise AssertionError("Upserting a table without keys should fail")
+except Exception as e:
+    assert 'no keys' in str(e)
+
+# Loaded string keys are searched as (memory mapped) Arrow strings, byte for byte
+path = tempfile.mkdtemp()
+index = TableIndex(pa.table({'key': ['a', 'a\x00', None] + [f'k{i}' for i in range(1000)]}), keys=['key'])
+loaded = TableIndex.load(path + '/index', index.save(path + '/index'))
+for probe in [pa.table({'key': ['a\x00', 'a', None, '']}), pa.table({'key': ['a\x00', 'a', None, ''] + [f'k{i}' for i in range(100)]})]:
+    assert loaded.lookup(probe).tolist() == index.lookup(probe).tolist()
+    assert loaded.lookup(probe).tolist()[:4] == [1, 0, -1, -1]
+assert isinstance(loaded.uniques[0], pa.Array)
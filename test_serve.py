@@ -0,0 +1,54 @@
+import asyncio
+import pyarrow as pa
+import pyarrow.compute as c
+from thor_mlops.starschema import ThorStarSchema
+from thor_mlops.serve import ThorBatcher
+
+# Concurrent requests are enriched in one batch, every caller gets the rows of its own request
+skus = pa.table({'sku': [1, 2, 3], 'price': [10., 20., 30.]})
+stores = pa.table({'store': [1, 2], 'size': [100., 200.]})
+
+def discount(t):
+    if 'sku' in t.column_names and c.any(c.equal(t.column('sku'), 666)).as_py():
+        raise ValueError("bad sku")
+    return c.multiply(t.column('price_c'), 0.5)
+
+sts = ThorStarSchema(numericals=['price', 'size', 'discount'], categoricals=[], one_hots=[], label='y')
+sts.register_table(name='skus', table=skus, keys=['sku'])
+sts.register_table(name='stores', table=stores, keys=['store'])
+sts.register_calculation(name='discount', func=discount, inputs=['price_c'])
+sts.enrich(pa.table({'sku': [1, 2, 3], 'store': [1, 2, 1]})) # MEASURE THE CALCULATION
+
+requests = [
+    {'sku': 1, 'store': 2},
+    {'sku': 2, 'y': 7}, # KEYS THE FIRST REQUEST DOES NOT HAVE
+    pa.table({'sku': [3, 1, 5], 'store': [1, 1, 2]}), # SEVERAL ROWS, ONE UNKNOWN SKU
+    {'store': 1},
+]
+
+async def serve(requests: list, **kwargs):
+    async with ThorBatcher(sts, max_batch=64, max_latency=0.05, **kwargs) as batcher:
+        results = await asyncio.gather(*[batcher.enrich(r) for r in requests], return_exceptions=True)
+    return batcher, results
+
+for compiled in [True, False]:
+    batcher, results = asyncio.run(serve(requests, compiled=compiled))
+    assert batcher.batches == 1 and batcher.requests == len(requests)
+    for request, (context, X, y, _) in zip(requests, results):
+        # SAME AS ENRICHING THE REQUEST ALONE, WITH THE KEYS OF THE OTHER REQUESTS AS NULLS (LIKE IN THE BATCH)
+        rows = ([request] if isinstance(request, dict) else request.to_pylist())
+        expected = pa.Table.from_pylist([{k: r.get(k) for k in ['sku', 'store', 'y']} for r in rows], schema=pa.schema([('sku', pa.int64()), ('store', pa.int64()), ('y', pa.int64())]))
+        e_context, e_X, e_y, _ = sts.enrich(expected)
+        assert X.to_pydict() == e_X.to_pydict(), (X.to_pydict(), e_X.to_pydict())
+        assert context.to_pydict() == e_context.to_pydict() and y.to_pylist() == e_y.to_pylist()
+    assert results[1][2].to_pylist() == [7] and results[0][2].to_pylist() == [None]
+    assert results[1][1].column('size').to_pylist() == [None] # NULL store KEY, NOT THE MISSING FEATURE FILL
+    assert results[2][1].column('price').to_pylist() == [30.0, 10.0, None]
+    results_ok = results
+
+    # A bad request fails on its own, the other requests of its batch still get their rows
+    batcher, results = asyncio.run(serve(requests[:2] + [{'sku': 666}] + requests[2:], compiled=compiled))
+    assert isinstance(results[2], ValueError) and 'bad sku' in str(results[2])
+    assert [r[1].num_rows for i, r in enumerate(results) if i != 2] == [1, 1, 3, 1]
+    assert results[1][1].column('discount').to_pylist() == [10.0]
+    assert results[4][1].to_pydict() == results_ok[3][1].to_pydict() # RETRIED WITH THE (NULL) sku COLUMN OF ITS BATCH
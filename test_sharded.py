@@ -0,0 +1,48 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as c
+from thor_mlops.starschema import ThorStarSchema
+
+# Sharded enrich (forked workers and in process) gives the rows of enrich, and leaves the registered tables as they were
+rng = np.random.default_rng(0)
+skus = pa.table({'sku': np.arange(50), 'price': rng.uniform(1, 100, 50), 'brand': rng.choice(['a', 'b', 'c'], 50)})
+weeks = pa.table({'week': np.arange(40), 'season': rng.choice(['SS', 'AW'], 40)}) # CORE WITHOUT KEYS: CROSS JOINED
+base = pa.table({'sku': np.arange(60) % 55, 'y': rng.integers(0, 10, 60)})
+
+FAIL = {'on': False}
+def discount(t):
+    if FAIL['on']:
+        raise ValueError("calculation failed")
+    return c.multiply(t.column('price_c'), 0.1)
+
+sts = ThorStarSchema(numericals=['price', 'discount'], categoricals=['brand'], one_hots=['season'], label='y')
+sts.register_table(name='skus', table=skus, keys=['sku'], core=True)
+sts.register_table(name='weeks', table=weeks, keys=[], contexts=['week'], core=True)
+sts.register_calculation(name='discount', func=discount, inputs=['price_c'])
+context, X, _, _ = sts.enrich(base)
+assert X.num_rows == 55 * 40
+
+def rows(context: pa.Table, X: pa.Table) -> pa.Table:
+    t = pa.Table.from_arrays(context.select(['sku', 'week']).columns + X.columns, names=['sku', 'week'] + X.column_names)
+    return t.sort_by([('sku', 'ascending'), ('week', 'ascending')])
+
+tables = dict(sts.tables)
+expected = rows(context, X)
+for processes, shard_rows in [(2, 300), (1, 300), (2, 25)]: # 25 < 40 WEEKS PER BASE ROW ALSO SLICES THE CROSS JOINED TABLE
+    parts = list(sts.enrich_sharded(base, shard_rows=shard_rows, processes=processes))
+    assert len(parts) > 1
+    sharded = rows(pa.concat_tables([p[0] for p in parts]), pa.concat_tables([p[1] for p in parts]))
+    assert sharded.equals(expected)
+    assert all(sts.tables[name] is v for name, v in tables.items()) and set(sts.tables) == set(tables)
+    assert sts.tables['weeks']['table'].num_rows == 40
+
+# A failing worker raises in the caller, the tables are restored
+FAIL['on'] = True
+for processes in [2, 1]:
+    try:
+        list(sts.enrich_sharded(base, shard_rows=300, processes=processes))
+        raise AssertionError("A failing shard should raise")
+    except ValueError as e:
+        assert 'calculation failed' in str(e)
+    assert all(sts.tables[name] is v for name, v in tables.items())
+    assert sts.tables['weeks']['table'].num_rows == 40
@@ -0,0 +1,19 @@
+import pyarrow as pa
+from thor_mlops.sketch import hash_strings, HyperLogLog
+
+# Hashes only depend on the value itself (not on the other values in the batch)
+short = pa.array([f'store_{i}' for i in range(200)])
+assert (hash_strings(short) == hash_strings(pa.concat_arrays([short, pa.array(['x' * 40])]))[:200]).all()
+assert hash_strings(pa.array(['a']))[0] != hash_strings(pa.array(['a\x00']))[0]
+assert hash_strings(pa.array(['a', 'b']).slice(1))[0] == hash_strings(pa.array(['b']))[0]
+
+# Merged HyperLogLogs of shards with different max lengths and duplicate values count every value once
+values = [f'value {i}' for i in range(5000)]
+shards = [pa.array(values[:3000] + ['x' * 100]), pa.array(values[2000:] * 2), pa.array(values[:10] + ['x' * 100, None])]
+hll = HyperLogLog()
+for shard in shards:
+    part = HyperLogLog()
+    part.update(shard)
+    hll.merge(part)
+print("Cardinality", hll.cardinality())
+assert abs(hll.cardinality() - 5001) < 5001 * 0.05
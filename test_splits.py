@@ -0,0 +1,14 @@
+import numpy as np
+import pyarrow as pa
+from thor_mlops.clean import FoldAssigner
+
+# Grouped splits: a key lands in the same fold in every batch, whatever the other keys of the batch are
+stores = [f'store_{i}' for i in range(200)]
+first = FoldAssigner(key='store').assign(pa.table({'store': stores}))
+second = FoldAssigner(key='store').assign(pa.table({'store': stores[::-1] + ['a much longer store key of 40 characters']}))
+assert (first == second[:200][::-1]).all()
+assert (FoldAssigner(key='store').assign(pa.table({'store': stores[:10]})) == first[:10]).all()
+
+# Integer keys hash like their string form
+assert (FoldAssigner(key='store').assign(pa.table({'store': np.arange(100)})) == FoldAssigner(key='store').assign(pa.table({'store': [str(i) for i in range(100)]}))).all()
+print("Folds", np.bincount(first))